@@ -3,204 +3,224 @@
 Script to fix existing Employee Checkin records that have incorrect IN/OUT log types.
 This script will:
 1. Find all Employee Checkin records from ZKTeco device (port 4370)
-2. Group by employee and date
-3. Reapply sequence-based IN/OUT detection
-4. Update records with correct log_type
+2. Compute the sequence-based IN/OUT type per employee and date in SQL
+3. Update records with correct log_type in chunked set-based UPDATEs
 
 Usage:
     bench --site erp.cosmopharmaint.com execute zkteco_checkins_sync.fix_existing_checkins.fix_all_checkins
 """
 
+import logging
+from collections import Counter
+
 import frappe
-from frappe.utils import get_datetime
-from collections import defaultdict
-from datetime import datetime
 
 
-def fix_all_checkins(dry_run=True):
+# Device mode checkins store device_id as "<ip>:<port>", so an anchored
+# prefix match is enough and lets MariaDB range-scan an index on device_id
+DEVICE_ID_FILTER = "111.88.28.220:4370%"
+FIX_FROM_DATE = "2025-09-01"  # Only fix recent records
+UPDATE_CHUNK_SIZE = 1000  # Names per UPDATE statement, keeps each IN (...) list bounded
+
+# Correct log type for every checkin, decided per employee per day by
+# parity: odd punches (1-based) are IN, even punches are OUT. Policy for
+# an odd count of punches: the last one is still forced to OUT, so a day
+# with more than one punch always closes with an OUT. Single-punch days,
+# the most common group, are settled by the first branch
+CLASSIFIED_CHECKINS_QUERY = """
+    SELECT name, employee, employee_name, time, log_type, rn,
+        CASE
+            WHEN cnt = 1 THEN 'IN'
+            WHEN rn = cnt THEN 'OUT'
+            WHEN MOD(rn, 2) = 1 THEN 'IN'
+            ELSE 'OUT'
+        END AS correct_log_type
+    FROM (
+        SELECT name, employee, employee_name, time, log_type,
+            ROW_NUMBER() OVER (PARTITION BY employee, CAST(time AS DATE) ORDER BY time) AS rn,
+            COUNT(*) OVER (PARTITION BY employee, CAST(time AS DATE)) AS cnt
+        FROM `tabEmployee Checkin`
+        WHERE device_id LIKE %(device_id)s AND time >= %(from_date)s
+    ) numbered
+"""
+
+# Per employee-day punch and correction counts, aggregated server-side so
+# Python never has to walk every row just to build the summary
+DAILY_SUMMARY_QUERY = f"""
+    SELECT employee, CAST(time AS DATE) AS date, COUNT(*) AS punches,
+        SUM(NOT (log_type <=> correct_log_type)) AS corrections
+    FROM ({CLASSIFIED_CHECKINS_QUERY}) x
+    GROUP BY employee, CAST(time AS DATE)
+    ORDER BY employee, date
+"""
+
+
+def _query_params():
+    return {"device_id": DEVICE_ID_FILTER, "from_date": FIX_FROM_DATE}
+
+
+def _preview_changes(changes_only=True):
+    """
+    Yield matching checkins with the log type they should have, ordered by employee and time.
+    With changes_only, rows that are already correct are filtered out in SQL.
+    Rows are streamed from a server-side cursor so memory stays flat regardless of row count.
+    """
+    condition = "WHERE NOT (x.log_type <=> x.correct_log_type)" if changes_only else ""
+    with frappe.db.unbuffered_cursor():
+        yield from frappe.db.sql(
+            f"SELECT * FROM ({CLASSIFIED_CHECKINS_QUERY}) x {condition} ORDER BY employee, time",
+            _query_params(),
+            as_dict=True,
+            as_iterator=True
+        )
+
+
+def _apply_changes(pending, log):
+    """
+    Rewrite log_type for the previewed (name, correct) pairs in chunks of UPDATE_CHUNK_SIZE.
+    Each chunk runs under its own savepoint: a failing chunk is rolled back to it and
+    skipped, while the caller still commits everything else once at the end.
+
+    Returns:
+        tuple: (updated_count, error_count)
+    """
+    user = frappe.session.user or "Administrator"
+    updated_count = 0
+    error_count = 0
+
+    for start in range(0, len(pending), UPDATE_CHUNK_SIZE):
+        chunk = pending[start:start + UPDATE_CHUNK_SIZE]
+        frappe.db.savepoint("checkin_fix_chunk")
+
+        try:
+            for log_type in ("IN", "OUT"):
+                chunk_names = tuple(name for name, correct in chunk if correct == log_type)
+                if not chunk_names:
+                    continue
+
+                frappe.db.sql(
+                    """UPDATE `tabEmployee Checkin`
+                        SET log_type = %(log_type)s, modified = NOW(), modified_by = %(user)s
+                        WHERE name IN %(names)s""",
+                    {"log_type": log_type, "user": user, "names": chunk_names}
+                )
+
+            frappe.db.release_savepoint("checkin_fix_chunk")
+            updated_count += len(chunk)
+
+        except Exception as e:
+            frappe.db.rollback(save_point="checkin_fix_chunk")
+            error_count += len(chunk)
+            log.error("Error updating records %s-%s: %s", start + 1, start + len(chunk), e)
+
+    return updated_count, error_count
+
+
+def fix_all_checkins(dry_run=True, verbose=False):
     """
     Fix all existing checkin records with incorrect log types
 
     Args:
         dry_run (bool): If True, only show what would be changed without actually updating
+        verbose (bool): If True, log every punch instead of one summary line per employee-date
     """
-    frappe.logger().info("="*80)
-    frappe.logger().info("STARTING EMPLOYEE CHECKIN FIX")
-    frappe.logger().info("="*80)
-
-    # Get all ZKTeco checkin records (device mode)
-    checkins = frappe.get_all("Employee Checkin",
-        filters={
-            "device_id": ["like", "%111.88.28.220:4370%"],
-            "time": [">=", "2025-09-01"]  # Only fix recent records
-        },
-        fields=["name", "employee", "employee_name", "time", "log_type", "device_id"],
-        order_by="employee asc, time asc"
-    )
-
-    frappe.logger().info(f"Found {len(checkins)} checkin records to analyze")
-
-    if not checkins:
-        frappe.logger().info("No records found to fix")
+    log = frappe.logger()
+    is_info = log.isEnabledFor(logging.INFO)
+    verbose = verbose and is_info
+
+    log.info("="*80)
+    log.info("STARTING EMPLOYEE CHECKIN FIX")
+    log.info("="*80)
+
+    # Per-day counts come straight from SQL
+    total_checkins = 0
+    total_corrections = 0
+
+    for day in frappe.db.sql(DAILY_SUMMARY_QUERY, _query_params(), as_dict=True):
+        total_checkins += day.punches
+        total_corrections += int(day.corrections or 0)
+        if is_info:
+            log.info("%s %s: %s punches, %s corrections", day.employee, day.date, day.punches, int(day.corrections or 0))
+
+    if not total_checkins:
+        log.info("No records found to fix")
         return {"success": True, "message": "No records found", "updated": 0}
 
-    # Group by employee and date
-    grouped = defaultdict(list)
-
-    for checkin in checkins:
-        emp = checkin.employee
-        dt = get_datetime(checkin.time)
-        date_key = dt.strftime("%Y-%m-%d")
-        grouped[(emp, date_key)].append({
-            "name": checkin.name,
-            "employee": checkin.employee,
-            "employee_name": checkin.employee_name,
-            "time": dt,
-            "current_log_type": checkin.log_type,
-            "device_id": checkin.device_id
-        })
-
-    frappe.logger().info(f"Grouped into {len(grouped)} employee-date combinations")
-
-    # Track changes
-    updates_needed = []
-    no_change_needed = 0
-
-    # Process each employee's daily checkins
-    for (emp, date), daily_checkins in grouped.items():
-        # Sort by time
-        daily_checkins.sort(key=lambda x: x["time"])
-
-        frappe.logger().info(f"\n{'='*60}")
-        frappe.logger().info(f"Employee: {daily_checkins[0]['employee_name']} ({emp})")
-        frappe.logger().info(f"Date: {date}")
-        frappe.logger().info(f"Total punches: {len(daily_checkins)}")
-
-        # Apply sequence logic
-        if len(daily_checkins) == 1:
-            # Single punch = IN
-            correct_log_type = "IN"
-            current = daily_checkins[0]["current_log_type"]
+    no_change_needed = total_checkins - total_corrections
+
+    # Only rows that need a change are looked at. A dry run just counts the
+    # change patterns; a real run keeps (name, correct) pairs to update.
+    # Already-correct rows never leave the database unless verbose mode
+    # wants to print every punch
+    change_patterns = Counter()
+    pending = []
+
+    if total_corrections or verbose:
+        for checkin in _preview_changes(changes_only=not verbose):
+            # Raw SQL already returns DATETIME columns as datetime objects
+            dt = checkin.time
+            current = checkin.log_type
+            correct_log_type = checkin.correct_log_type
 
             if current != correct_log_type:
-                frappe.logger().info(f"  Single punch - Should be IN (currently: {current})")
-                updates_needed.append({
-                    "name": daily_checkins[0]["name"],
-                    "employee_name": daily_checkins[0]["employee_name"],
-                    "time": daily_checkins[0]["time"],
-                    "current": current,
-                    "correct": correct_log_type
-                })
-            else:
-                no_change_needed += 1
-                frappe.logger().info(f"  ✓ Single punch - Already correct (IN)")
-
-        else:
-            # Multiple punches - alternate IN/OUT
-            for idx, checkin in enumerate(daily_checkins):
-                # First punch = IN, then alternate
-                if idx == 0:
-                    correct_log_type = "IN"
-                elif idx == len(daily_checkins) - 1:
-                    # Last punch should be OUT (if more than 1 punch)
-                    correct_log_type = "OUT"
-                else:
-                    # Middle punches alternate
-                    prev_type = daily_checkins[idx - 1].get("correct_log_type") or daily_checkins[idx - 1]["current_log_type"]
-                    correct_log_type = "OUT" if prev_type == "IN" else "IN"
-
-                # Store correct type for next iteration
-                checkin["correct_log_type"] = correct_log_type
-
-                current = checkin["current_log_type"]
-                time_str = checkin["time"].strftime("%H:%M:%S")
-
-                if current != correct_log_type:
-                    frappe.logger().info(f"  {idx+1}. {time_str} - Should be {correct_log_type} (currently: {current}) ❌")
-                    updates_needed.append({
-                        "name": checkin["name"],
-                        "employee_name": checkin["employee_name"],
-                        "time": checkin["time"],
-                        "current": current,
-                        "correct": correct_log_type
-                    })
-                else:
-                    no_change_needed += 1
-                    frappe.logger().info(f"  {idx+1}. {time_str} - Already correct ({correct_log_type}) ✓")
+                if verbose:
+                    log.info("  %s %s. %s - Should be %s (currently: %s) ❌", checkin.employee_name, checkin.rn, dt.strftime("%H:%M:%S"), correct_log_type, current)
+                change_patterns[(current, correct_log_type)] += 1
+                if not dry_run:
+                    pending.append((checkin.name, correct_log_type))
+            elif verbose:
+                log.info("  %s %s. %s - Already correct (%s) ✓", checkin.employee_name, checkin.rn, dt.strftime("%H:%M:%S"), correct_log_type)
 
     # Summary
-    frappe.logger().info("\n" + "="*80)
-    frappe.logger().info("SUMMARY")
-    frappe.logger().info("="*80)
-    frappe.logger().info(f"Total records analyzed: {len(checkins)}")
-    frappe.logger().info(f"Records needing update: {len(updates_needed)}")
-    frappe.logger().info(f"Records already correct: {no_change_needed}")
+    log.info("\n" + "="*80)
+    log.info("SUMMARY")
+    log.info("="*80)
+    updates_needed = sum(change_patterns.values())
+    log.info("Total records analyzed: %s", total_checkins)
+    log.info("Records needing update: %s", updates_needed)
+    log.info("Records already correct: %s", no_change_needed)
 
     if not updates_needed:
-        frappe.logger().info("\n✅ All records are already correct!")
+        log.info("\n✅ All records are already correct!")
         return {"success": True, "message": "All records already correct", "updated": 0}
 
     # Show what will be updated
-    frappe.logger().info("\n" + "="*80)
-    frappe.logger().info("UPDATES TO BE MADE:")
-    frappe.logger().info("="*80)
-
-    for update in updates_needed[:20]:  # Show first 20
-        frappe.logger().info(f"{update['employee_name']} | {update['time'].strftime('%Y-%m-%d %H:%M')} | {update['current']} → {update['correct']}")
+    log.info("\n" + "="*80)
+    log.info("UPDATES TO BE MADE:")
+    log.info("="*80)
 
-    if len(updates_needed) > 20:
-        frappe.logger().info(f"... and {len(updates_needed) - 20} more")
+    for (current, correct), count in change_patterns.most_common():
+        log.info("%s → %s: %s", current, correct, count)
 
     # Apply updates if not dry run
     if dry_run:
-        frappe.logger().info("\n" + "="*80)
-        frappe.logger().info("🔍 DRY RUN MODE - No changes made")
-        frappe.logger().info("To apply changes, run:")
-        frappe.logger().info("  bench --site erp.cosmopharmaint.com execute 'zkteco_checkins_sync.fix_existing_checkins.fix_all_checkins' --kwargs '{\"dry_run\": False}'")
-        frappe.logger().info("="*80)
+        log.info("\n" + "="*80)
+        log.info("🔍 DRY RUN MODE - No changes made")
+        log.info("To apply changes, run:")
+        log.info("  bench --site erp.cosmopharmaint.com execute 'zkteco_checkins_sync.fix_existing_checkins.fix_all_checkins' --kwargs '{\"dry_run\": False}'")
+        log.info("="*80)
 
         return {
             "success": True,
             "dry_run": True,
-            "updates_needed": len(updates_needed),
+            "updates_needed": updates_needed,
             "no_change_needed": no_change_needed
         }
 
     else:
-        frappe.logger().info("\n" + "="*80)
-        frappe.logger().info("⚙️  APPLYING UPDATES...")
-        frappe.logger().info("="*80)
-
-        updated_count = 0
-        error_count = 0
-
-        for update in updates_needed:
-            try:
-                frappe.db.set_value("Employee Checkin",
-                    update["name"],
-                    "log_type",
-                    update["correct"],
-                    update_modified=True
-                )
-                updated_count += 1
-
-                if updated_count % 10 == 0:
-                    frappe.logger().info(f"  Updated {updated_count}/{len(updates_needed)} records...")
-                    frappe.db.commit()
-
-            except Exception as e:
-                error_count += 1
-                frappe.logger().error(f"Error updating {update['name']}: {str(e)}")
+        log.info("\n" + "="*80)
+        log.info("⚙️  APPLYING UPDATES...")
+        log.info("="*80)
 
-        # Final commit
+        updated_count, error_count = _apply_changes(pending, log)
         frappe.db.commit()
 
-        frappe.logger().info("\n" + "="*80)
-        frappe.logger().info("✅ UPDATE COMPLETE")
-        frappe.logger().info("="*80)
-        frappe.logger().info(f"Successfully updated: {updated_count}")
-        frappe.logger().info(f"Errors: {error_count}")
-        frappe.logger().info("="*80)
+        log.info("\n" + "="*80)
+        log.info("✅ UPDATE COMPLETE")
+        log.info("="*80)
+        log.info("Successfully updated: %s", updated_count)
+        log.info("Errors: %s", error_count)
+        log.info("="*80)
 
         return {
             "success": True,
@@ -1,3 +1,14 @@
+from bisect import bisect_left as _bisect_left
+from sys import intern as _intern
+from time import monotonic as _monotonic
+
+# Imported under private names: Frappe registers every public name in hooks.py as a
+# hook, and the hooks dict is pickled into the cache, which a module object breaks
+try:
+    import frappe as _frappe
+except ImportError:
+    _frappe = None
+
 app_name = "zkteco_checkins_sync"
 app_title = "ZKTeco Checkin Sync"
 app_publisher = "osama.ahmed@deliverydevs.com"
@@ -148,96 +159,113 @@ app_license = "mit"
 # Scheduled Tasks - Dynamic ZKTeco Sync
 # ---------------
 
+# Names are underscored so Frappe does not pick them up as hooks
+# Interned: dotted paths are not interned automatically, and these are compared as dict keys
+_SYNC_HANDLER = _intern("zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.scheduled_sync")
+
+# (max sync seconds, cron) pairs, ascending
+_CRON_TABLE = (
+    (60, "* * * * *"),        # every minute or less
+    (300, "*/5 * * * *"),     # 5 minutes
+    (600, "*/10 * * * *"),    # 10 minutes
+    (900, "*/15 * * * *"),    # 15 minutes
+    (1800, "*/30 * * * *"),   # 30 minutes
+)
+_CRON_THRESHOLDS = tuple(seconds for seconds, _ in _CRON_TABLE)
+
+# Every possible result is built once here and shared. Handler lists stay lists:
+# Frappe's append_hook wraps anything that is not a list (a tuple included) in a new list
+_SYNC_HANDLERS = [_SYNC_HANDLER]
+_CRON_EVENTS = tuple({"cron": {cron: _SYNC_HANDLERS}} for _, cron in _CRON_TABLE)
+_HOURLY_EVENTS = {"hourly": _SYNC_HANDLERS}
+
+
+def _events_for_seconds(sync_seconds):
+    # Map seconds to the first cron whose interval covers them, hourly beyond the table
+    i = _bisect_left(_CRON_THRESHOLDS, sync_seconds)
+    return _CRON_EVENTS[i] if i < len(_CRON_EVENTS) else _HOURLY_EVENTS
+
+
+# ZKTeco Config.seconds is a Select stored as text; its options resolve straight to
+# events without int parsing or bisecting. Keep in sync with the field's options
+_EVENTS_BY_OPTION = {
+    option: _events_for_seconds(int(option))
+    for option in ("10", "30", "60", "120", "300", "600", "900", "1800", "3600")
+}
+
+# Computed scheduler events per site as (monotonic time, events), reused for _EVENTS_TTL seconds
+_EVENTS_TTL = 60
+_events_cache = {}
+
+
 def get_scheduler_events():
     """
     Dynamic scheduler that adjusts based on ZKTeco Config settings
+    Memoized per site for _EVENTS_TTL seconds; ZKTeco Config clears it on save
     """
-    import frappe
-    
+    # Nothing to read without a connected site (bench build, get-app, early imports):
+    # skip the lookup and its exception handling entirely
+    if _frappe is None or not getattr(_frappe.local, "conf", None) or not getattr(_frappe, "db", None):
+        return {}
+
+    site = getattr(_frappe.local, "site", None)
+    now = _monotonic()
+    cached = _events_cache.get(site)
+    if cached and now - cached[0] < _EVENTS_TTL:
+        return cached[1]
+
+    events = _compute_scheduler_events()
+    _events_cache[site] = (now, events)
+    return events
+
+
+def _invalidate_scheduler_events():
+    _events_cache.clear()
+
+
+def _compute_scheduler_events():
     # Get sync settings
     try:
-        cfg = frappe.get_single("ZKTeco Config")
-        if not cfg.enable_sync:
-            return {}
-        
-        sync_seconds = int(cfg.seconds or 300)  # Default 5 minutes
-        
-        # Map seconds to cron expressions
-        sync_schedule = {}
-        
-        if sync_seconds <= 60:
-            # For frequent syncs (every minute or less), use cron for every minute
-            sync_schedule = {
-                "cron": {
-                    "* * * * *": [
-                        "zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.scheduled_sync"
-                    ]
-                }
-            }
-        elif sync_seconds <= 300:  # 5 minutes
-            sync_schedule = {
-                "cron": {
-                    "*/5 * * * *": [
-                        "zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.scheduled_sync"
-                    ]
-                }
-            }
-        elif sync_seconds <= 600:  # 10 minutes
-            sync_schedule = {
-                "cron": {
-                    "*/10 * * * *": [
-                        "zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.scheduled_sync"
-                    ]
-                }
-            }
-        elif sync_seconds <= 900:  # 15 minutes
-            sync_schedule = {
-                "cron": {
-                    "*/15 * * * *": [
-                        "zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.scheduled_sync"
-                    ]
-                }
-            }
-        elif sync_seconds <= 1800:  # 30 minutes
-            sync_schedule = {
-                "cron": {
-                    "*/30 * * * *": [
-                        "zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.scheduled_sync"
-                    ]
-                }
-            }
-        else:  # 1 hour or more
-            sync_schedule = {
-                "hourly": [
-                    "zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.scheduled_sync"
-                ]
-            }
-        
-        return sync_schedule
-        
-    except Exception as e:
-        frappe.log_error(f"Error in ZKTeco dynamic scheduler: {str(e)}", "ZKTeco Scheduler Error")
+        # Both fields in one SELECT on tabSingles, without building the document
+        enable_sync, seconds = _frappe.db.get_value("ZKTeco Config", None, ["enable_sync", "seconds"]) or (None, None)
+    except (_frappe.DoesNotExistError, AttributeError):
+        # Expected before the app is migrated or when no site is connected: fall back quietly
+        return {}
+    except Exception:
+        # File log only: this mostly fires while the database is unreachable, when an
+        # Error Log insert would fail too
+        _frappe.logger("scheduler").warning("ZKTeco dynamic scheduler unavailable", exc_info=True)
         return {}
 
-# # Apply dynamic scheduler
-# scheduler_events = get_scheduler_events()
-# Apply dynamic scheduler only after installation
-try:
-    scheduler_events = get_scheduler_events()
-except Exception:
-    scheduler_events = {}
-
-
-# Fallback static scheduler for basic functionality
-if not scheduler_events:
-    scheduler_events = {
-        "all": [
-            "zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.cleanup_scheduler_check"
-        ],
-        "hourly": [
-            "zkteco_checkins_sync.zkteco_checkin_sync.doctype.zkteco_config.zkteco_config.scheduled_sync"
-        ]
-    }
+    if not _frappe.utils.cint(enable_sync):
+        return {}
+
+    events = _EVENTS_BY_OPTION.get(seconds or "300")  # Default 5 minutes
+    if events is None:
+        events = _events_for_seconds(int(seconds))
+    return events
+
+
+# Fallback static scheduler for basic functionality, built once and shared. It stays a
+# plain dict: append_hook only merges dict instances and the hooks cache must pickle it.
+# The scheduler check runs from scheduled_sync itself rather than on the every-tick "all" event
+_STATIC_FALLBACK = _HOURLY_EVENTS
+
+
+# Apply dynamic scheduler lazily (PEP 562): importing hooks for bench commands that
+# never read scheduler_events no longer touches the database
+def __getattr__(name):
+    if name == "scheduler_events":
+        try:
+            return get_scheduler_events() or _STATIC_FALLBACK
+        except Exception:
+            return _STATIC_FALLBACK
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Frappe collects hooks by walking dir() of this module, so the lazy name must be listed
+def __dir__():
+    return sorted([*globals(), "scheduler_events"])
 
 # Testing
 # -------
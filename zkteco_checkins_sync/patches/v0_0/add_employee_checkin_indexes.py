@@ -0,0 +1,11 @@
+import frappe
+
+
+def execute():
+    """
+    Add composite indexes used by the checkin log type fix and the sync:
+    (device_id, time) for the device/date filter and (employee, time) for
+    the per-employee ordering
+    """
+    frappe.db.add_index("Employee Checkin", ["device_id(64)", "time"], index_name="idx_ec_device_time")
+    frappe.db.add_index("Employee Checkin", ["employee", "time"], index_name="idx_ec_emp_time")
@@ -5,10 +5,21 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 import requests
-from frappe.utils import today, now_datetime, get_datetime, flt, cint
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from frappe.utils import today, now_datetime, get_datetime, cint
 from datetime import datetime, timedelta
+import errno
 import json
+import logging
+import re
+import select
 import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from itertools import groupby
 try:
     from zk import ZK
 except Exception:
@@ -34,6 +45,100 @@ class ZKTecoConfig(Document):
             if self.enable_sync and not self.server_ip:
                 frappe.throw(_("Server IP is required when multi-IP configuration is not used"))
 
+    def on_update(self):
+        """Recompute the sync schedule from the new settings on next hooks load"""
+        from zkteco_checkins_sync.hooks import _invalidate_scheduler_events
+
+        _invalidate_scheduler_events()
+
+
+# Shared HTTP session for API mode: keeps TCP/TLS connections to the
+# ZKTeco server alive between requests and devices. Gateway errors are
+# retried, and the last response is returned rather than raised so callers
+# still see the status code and body
+_SESSION = requests.Session()
+_SESSION.headers.update({"Connection": "keep-alive", "User-Agent": "zkteco-checkins-sync"})
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504], allowed_methods=None, raise_on_status=False)
+)
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+_HTTPS_PORTS = frozenset({443, 8443})
+
+# Seconds to wait for a device's TCP port to accept a connection
+DEVICE_CHECK_TIMEOUT = 1.0
+
+# A failing device logs to Error Log at most once per this many seconds
+ERROR_LOG_INTERVAL = 600
+
+# Network failures that just mean a device is offline or unreachable
+_UNREACHABLE_ERRORS = (TimeoutError, ConnectionError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+# Upper bound on devices probed or synced concurrently
+MAX_SYNC_WORKERS = 8
+
+# Indicator tables for detect_log_type, compiled once instead of per call
+_OUT_PATTERN = re.compile("OUT|EXIT")  # covers OUT, CHECK OUT, CHECKOUT, CHK OUT, CHKOUT, OUTGOING, EXIT
+_IN_PATTERN = re.compile("IN|ENTRY")  # covers IN, CHECK IN, CHECKIN, CHK IN, CHKIN, ENTRY
+_DISPLAY_OUT_PATTERN = re.compile("out|چیک آؤٹ")
+_DISPLAY_IN_PATTERN = re.compile("in|چیک ان")
+_NUMERIC_LOG_TYPE_FIELDS = (
+    # (field_name, out_value, in_value)
+    ('punch_state', 1, 0),
+    ('punch', 1, 0),
+    ('punchtype', 1, 0),
+    ('verify_type', 1, 0),
+)
+
+
+# Fields that may carry the punch time, in order of preference
+_TIME_FIELDS = (
+    'punch_time', 'punchTime', 'timestamp', 'datetime',
+    'date_time', 'check_time', 'time', 'created_at'
+)
+
+# Fallback patterns for strings datetime.fromisoformat can't read. Matching
+# once replaces probing strptime formats and raising ValueError on each miss
+_SLASH_TIME_PATTERN = re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{4}) (\d{1,2}):(\d{1,2})(?::(\d{1,2}))?$")  # 12/08/2023 14:30[:45]
+_ISO_OFFSET_PATTERN = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})[ T](\d{1,2}):(\d{1,2}):(\d{1,2})(?:Z|[+-]\d{4})$")  # 2023-12-08T14:30:45Z / +0500
+
+
+def _parse_punch_time(value):
+    """
+    Parse a punch time string, trying the C-implemented ISO parser first
+    Returns None if no known format matches
+    """
+    try:
+        # Covers 2023-12-08 14:30:45, fractions, T separator, date only and HH:MM
+        return datetime.fromisoformat(value)
+    except ValueError:
+        pass
+
+    match = _SLASH_TIME_PATTERN.match(value)
+    if match:
+        first, second, year, hour, minute, second_of_minute = match.groups()
+        hms = (int(hour), int(minute), int(second_of_minute or 0))
+        # Month first, then day first, matching the old %m/%d/%Y then %d/%m/%Y order
+        for month, day in ((first, second), (second, first)):
+            try:
+                return datetime(int(year), int(month), int(day), *hms)
+            except ValueError:
+                continue
+        return None
+
+    match = _ISO_OFFSET_PATTERN.match(value)
+    if match:
+        # Older Pythons' fromisoformat rejects Z/+HHMM; the offset is dropped like the caller does
+        try:
+            return datetime(*map(int, match.groups()))
+        except ValueError:
+            return None
+
+    return None
+
 
 def build_api_url(server_ip, server_port, endpoint="", use_https=None):
     """
@@ -48,15 +153,7 @@ def build_api_url(server_ip, server_port, endpoint="", use_https=None):
     Returns:
         Full URL string
     """
-    # Auto-detect protocol based on port if not specified
-    if use_https is None:
-        # Common HTTPS ports: 443, 8443
-        # Common HTTP ports: 80, 8080, 4370
-        port_int = int(str(server_port).strip())
-        use_https = port_int in [443, 8443]
-
-    protocol = "https" if use_https else "http"
-    base_url = f"{protocol}://{server_ip}:{server_port}"
+    base_url = _base_url(server_ip, server_port, use_https)
 
     if endpoint:
         # Ensure endpoint starts with /
@@ -67,125 +164,94 @@ def build_api_url(server_ip, server_port, endpoint="", use_https=None):
     return base_url
 
 
+@lru_cache(maxsize=128)
+def _base_url(server_ip, server_port, use_https):
+    """
+    protocol://ip:port for a device; the device set is small and stable, so results are cached
+    """
+    # Auto-detect protocol based on port if not specified
+    if use_https is None:
+        # Common HTTPS ports: 443, 8443
+        # Common HTTP ports: 80, 8080, 4370
+        use_https = int(str(server_port).strip()) in _HTTPS_PORTS
+
+    protocol = "https" if use_https else "http"
+    return f"{protocol}://{server_ip}:{server_port}"
+
+
 def detect_log_type(transaction):
     """
     Intelligently detect if transaction is IN or OUT
     Checks multiple possible fields from ZKTeco
     """
-    # Log the raw transaction for debugging
-    frappe.logger().info("===== DETECT_LOG_TYPE START =====")
-    frappe.logger().info(f"Transaction data: {json.dumps(transaction, default=str, ensure_ascii=False, indent=2)}")
-    
-    # First, check for any field that might contain 'IN' or 'OUT' directly
+    # Fast path: the ZKTeco SDK almost always sends a numeric punch/punch_state
+    # (0 = IN, 1 = OUT), so settle those with a lookup before any string scan
+    for field in ('punch', 'punch_state'):
+        value = transaction.get(field)
+        if value in (0, 1):
+            return "OUT" if value == 1 else "IN"
+
+    log = frappe.logger()
+    debug = log.isEnabledFor(logging.DEBUG)
+    display_match = None
+    key_match = None
+
+    # Single pass: any field containing an IN/OUT indicator decides directly,
+    # while Urdu display matches are remembered as lower-priority fallbacks
     for key, value in transaction.items():
         if not value and value not in [0, False]:
             continue
-            
+
         value_str = str(value).upper().strip()
-        
-        # Check for OUT indicators
-        out_indicators = ['OUT', 'CHECK OUT', 'CHECKOUT', 'CHK OUT', 'CHKOUT', 'OUTGOING', 'EXIT']
-        if any(x in value_str for x in out_indicators):
-            frappe.logger().info(f"✅ Found OUT indicator in field '{key}': {value}")
+
+        if _OUT_PATTERN.search(value_str):
+            if debug:
+                log.debug("Found OUT indicator in field '%s': %s", key, value)
             return "OUT"
-            
-        # Check for IN indicators
-        in_indicators = ['IN', 'CHECK IN', 'CHECKIN', 'CHK IN', 'CHKIN', 'ENTRY']
-        if any(x in value_str for x in in_indicators):
-            frappe.logger().info(f"✅ Found IN indicator in field '{key}': {value}")
+
+        if _IN_PATTERN.search(value_str):
+            if debug:
+                log.debug("Found IN indicator in field '%s': %s", key, value)
             return "IN"
-    
-    # Try specific known fields with standard processing
-    field_checks = [
-        # (field_name, is_numeric, out_value, in_value)
-        ('log_type', False, 'OUT', 'IN'),
-        ('punch_state', True, 1, 0),
-        ('punch', True, 1, 0),
-        ('punchtype', True, 1, 0),
-        ('type', False, 'OUT', 'IN'),
-        ('direction', False, 'OUT', 'IN'),
-        ('status', False, 'OUT', 'IN'),
-        ('verify_type', True, 1, 0),
-    ]
-    
-    frappe.logger().info("Checking standard fields...")
-    for field, is_numeric, out_val, in_val in field_checks:
-        if field not in transaction or transaction[field] is None:
-            frappe.logger().debug(f"Field '{field}' not found in transaction")
+
+        if key_match is None or (display_match is None and key == 'punch_state_display'):
+            lowered = value_str.lower()
+            found = "OUT" if _DISPLAY_OUT_PATTERN.search(lowered) else "IN" if _DISPLAY_IN_PATTERN.search(lowered) else None
+            if found:
+                if key == 'punch_state_display':
+                    display_match = found
+                key_lower = key.lower()
+                if key_match is None and ('punch' in key_lower or 'state' in key_lower or 'type' in key_lower):
+                    key_match = found
+
+    # Numeric state fields; string fields equal to IN/OUT were already matched above
+    for field, out_val, in_val in _NUMERIC_LOG_TYPE_FIELDS:
+        if transaction.get(field) is None:
             continue
-            
+
         try:
-            if is_numeric:
-                # Handle numeric fields
-                val = int(transaction[field])
-                if val == out_val:
-                    frappe.logger().info(f"✅ Using numeric field '{field}': {val} -> OUT")
-                    return "OUT"
-                elif val == in_val:
-                    frappe.logger().info(f"✅ Using numeric field '{field}': {val} -> IN")
-                    return "IN"
-                else:
-                    frappe.logger().debug(f"Numeric field '{field}' value {val} doesn't match OUT ({out_val}) or IN ({in_val})")
-            else:
-                # Handle string fields
-                val = str(transaction[field]).upper().strip()
-                out_val_upper = str(out_val).upper()
-                in_val_upper = str(in_val).upper()
-                
-                if val == out_val_upper:
-                    frappe.logger().info(f"✅ Using string field '{field}': {val} -> OUT")
-                    return "OUT"
-                elif val == in_val_upper:
-                    frappe.logger().info(f"✅ Using string field '{field}': {val} -> IN")
-                    return "IN"
-                else:
-                    frappe.logger().debug(f"String field '{field}' value '{val}' doesn't match OUT ('{out_val_upper}') or IN ('{in_val_upper}')")
+            val = int(transaction[field])
         except (ValueError, TypeError) as e:
-            frappe.logger().warning(f"Error processing field '{field}': {str(e)}")
-    
-    # Check for punch_state_display (text) - common in ZKTeco
-    punch_state_display = str(transaction.get('punch_state_display', '')).lower().strip()
-    if punch_state_display:
-        frappe.logger().info(f"Checking punch_state_display: '{punch_state_display}'")
-        out_indicators = ['out', 'check out', 'checkout', 'چیک آؤٹ']
-        in_indicators = ['in', 'check in', 'checkin', 'چیک ان']
-        
-        if any(x in punch_state_display for x in out_indicators):
-            frappe.logger().info(f"✅ Using punch_state_display (OUT): {punch_state_display}")
+            log.warning(f"Error processing field '{field}': {str(e)}")
+            continue
+
+        if val == out_val:
+            if debug:
+                log.debug("Using numeric field '%s': %s -> OUT", field, val)
             return "OUT"
-        elif any(x in punch_state_display for x in in_indicators):
-            frappe.logger().info(f"✅ Using punch_state_display (IN): {punch_state_display}")
+        elif val == in_val:
+            if debug:
+                log.debug("Using numeric field '%s': %s -> IN", field, val)
             return "IN"
-    
-    # Check for any field that might contain 'punch' or 'state'
-    frappe.logger().info("Checking all fields for punch/state indicators...")
-    for key, value in transaction.items():
-        if not value and value not in [0, False]:
-            continue
-            
-        key_lower = key.lower()
-        if 'punch' in key_lower or 'state' in key_lower or 'type' in key_lower:
-            value_str = str(value).lower()
-            out_indicators = ['out', 'check out', 'checkout', 'چیک آؤٹ']
-            in_indicators = ['in', 'check in', 'checkin', 'چیک ان']
-            
-            if any(x in value_str for x in out_indicators):
-                frappe.logger().info(f"✅ Using field '{key}' (OUT): {value}")
-                return "OUT"
-            elif any(x in value_str for x in in_indicators):
-                frappe.logger().info(f"✅ Using field '{key}' (IN): {value}")
-                return "IN"
-            else:
-                frappe.logger().debug(f"Field '{key}' with value '{value}' didn't match any indicators")
-    
-    # Log all keys for debugging
-    frappe.logger().info("All transaction keys and values:")
-    for key, value in transaction.items():
-        frappe.logger().info(f"  {key}: {value} (type: {type(value).__name__})")
-    
+
+    # punch_state_display (text) is common in ZKTeco, then any punch/state/type field
+    if display_match:
+        return display_match
+    if key_match:
+        return key_match
+
     # Default to IN if we can't determine (more common to have check-ins than check-outs)
-    frappe.logger().warning("❌ Could not determine log type for transaction, defaulting to IN")
-    frappe.logger().info("===== DETECT_LOG_TYPE END =====")
+    log.warning(f"❌ Could not determine log type for transaction, defaulting to IN (keys: {list(transaction.keys())})")
     return "IN"
 
 
@@ -195,23 +261,26 @@ def check_device_status(server_ip=None, server_port=None):
     Simple socket connection check to device
     Returns device status without needing token
     """
-    server_ip = server_ip or frappe.db.get_single_value("ZKTeco Config", "server_ip")
-    server_port = server_port or frappe.db.get_single_value("ZKTeco Config", "server_port")
+    if not server_ip or not server_port:
+        # One cached lookup for both values instead of two single-value queries
+        cfg_ip, cfg_port = frappe.get_cached_value("ZKTeco Config", "ZKTeco Config", ("server_ip", "server_port"))
+        server_ip = server_ip or cfg_ip
+        server_port = server_port or cfg_port
     
     if not server_ip or not server_port:
         return {"connected": False, "error": "Server IP or Port not configured"}
     
     try:
-        import socket
-        import time
-        
-        start_time = time.time()
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(5)
-        
-        result = s.connect_ex((server_ip, int(server_port)))
-        response_time = (time.time() - start_time) * 1000  # Convert to ms
-        s.close()
+        start_time = time.perf_counter()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            # Non-blocking connect with a short select() deadline, so an offline
+            # device costs DEVICE_CHECK_TIMEOUT instead of a full blocking timeout
+            s.setblocking(False)
+            result = s.connect_ex((server_ip, int(server_port)))
+            if result in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                _, writable, _ = select.select([], [s], [], DEVICE_CHECK_TIMEOUT)
+                result = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) if writable else errno.ETIMEDOUT
+            response_time = (time.perf_counter() - start_time) * 1000  # Convert to ms
         
         if result == 0:
             return {
@@ -236,26 +305,41 @@ def check_device_status(server_ip=None, server_port=None):
         }
 
 
-def get_all_devices():
+@dataclass(slots=True, frozen=True)
+class Device:
+    """
+    A configured ZKTeco device (primary server or a multi-IP row)
+    """
+    ip: str
+    port: str
+    device_name: str
+    user: str
+    password: str
+    token: str
+    enable_sync: int
+
+
+def get_all_devices(config=None):
     """
     Get all configured devices - both primary and multi-IP
+    Pass an already loaded config to avoid reading it again
     """
-    config = frappe.get_single("ZKTeco Config")
+    config = config or frappe.get_cached_doc("ZKTeco Config")
     
     devices = []
     
     # Add primary device if multi-IP is not configured
     if not config.multi_ip or len(config.multi_ip) == 0:
         if config.server_ip and config.server_port:
-            devices.append({
-                "ip": config.server_ip,
-                "port": config.server_port,
-                "device_name": "Primary Device",
-                "user": config.username,
-                "password": config.password,
-                "token": config.token,
-                "enable_sync": config.enable_sync
-            })
+            devices.append(Device(
+                ip=config.server_ip,
+                port=config.server_port,
+                device_name="Primary Device",
+                user=config.username,
+                password=config.password,
+                token=config.token,
+                enable_sync=config.enable_sync
+            ))
     else:
         # Add all multi-IP devices
         for ip_entry in config.multi_ip:
@@ -264,15 +348,15 @@ def get_all_devices():
             device_name = getattr(ip_entry, 'device_name', None) or f"Device-{ip_entry.idx}"
             
             if enable_sync:
-                devices.append({
-                    "ip": ip_entry.ip,
-                    "port": ip_entry.port,
-                    "device_name": device_name,
-                    "user": ip_entry.user,
-                    "password": ip_entry.password,
-                    "token": config.token,  # Use global token for all devices
-                    "enable_sync": enable_sync
-                })
+                devices.append(Device(
+                    ip=ip_entry.ip,
+                    port=ip_entry.port,
+                    device_name=device_name,
+                    user=ip_entry.user,
+                    password=ip_entry.password,
+                    token=config.token,  # Use global token for all devices
+                    enable_sync=enable_sync
+                ))
     
     return devices
 
@@ -283,14 +367,21 @@ def check_all_devices_status():
     Check status of all configured devices
     """
     devices = get_all_devices()
-    results = []
+    if not devices:
+        return []
 
-    for device in devices:
-        status = check_device_status(device["ip"], device["port"])
-        status["device_name"] = device["device_name"]
-        results.append(status)
+    def check(device):
+        # Only the socket probe runs in the worker; it needs no database access
+        if not device.ip or not device.port:
+            status = {"connected": False, "error": "Server IP or Port not configured"}
+        else:
+            status = check_device_status(device.ip, device.port)
+        status["device_name"] = device.device_name
+        return status
 
-    return results
+    # Probes are pure network waits, so run them side by side
+    with ThreadPoolExecutor(max_workers=min(MAX_SYNC_WORKERS, len(devices))) as executor:
+        return list(executor.map(check, devices))
 
 
 @frappe.whitelist()
@@ -298,57 +389,113 @@ def sync_all_devices():
     """
     Synchronize all configured devices
     """
-    devices = get_all_devices()
+    devices = [device for device in get_all_devices() if device.enable_sync]
+    if not devices:
+        return []
+
+    # Each device sync is dominated by network I/O, so devices run in
+    # parallel; every worker opens its own site connection
+    site = frappe.local.site
     results = []
 
-    for device in devices:
-        if device["enable_sync"]:
+    with ThreadPoolExecutor(max_workers=min(MAX_SYNC_WORKERS, len(devices))) as executor:
+        futures = [executor.submit(_sync_device_in_thread, site, device) for device in devices]
+
+        for device, future in zip(devices, futures):
             try:
-                # For each device, we'll need to sync it individually
-                result = sync_single_device(device)
-                result["device_name"] = device["device_name"]
+                result = future.result()
+                result["device_name"] = device.device_name
                 results.append(result)
             except Exception as e:
                 results.append({
-                    "device_name": device["device_name"],
+                    "device_name": device.device_name,
                     "success": False,
                     "error": str(e)
                 })
 
+    # Stats were written with raw UPDATEs, so drop the cached config once
+    frappe.clear_document_cache("ZKTeco Config", "ZKTeco Config")
     return results
 
 
+def _sync_device_in_thread(site, device):
+    """
+    Run sync_single_device in a worker thread with its own Frappe context
+    """
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        result = sync_single_device(device)
+        # Checkins and device stats from this worker are committed together
+        frappe.db.commit()
+        return result
+    finally:
+        frappe.destroy()
+
+
 def sync_single_device(device):
     """
     Synchronize a single device
     """
     try:
-        if device["port"] == "4370":
+        if device.port == "4370":
             # Device mode sync
-            return device_mode_sync_single(device)
+            result = device_mode_sync_single(device)
         else:
             # API mode sync
-            return api_mode_sync_single(device)
+            result = api_mode_sync_single(device)
+
+        # One summary line per device instead of a log line per record
+        if result.get("success"):
+            frappe.logger().info(
+                "%s:%s synced %d records, %d IN, %d OUT",
+                device.ip, device.port, result.get("created", 0), result.get("in_count", 0), result.get("out_count", 0)
+            )
+        return result
     except Exception as e:
-        frappe.log_error(f"Error syncing device {device['ip']}: {str(e)}", "ZKTeco Single Device Sync")
+        log_device_error(device.ip, device.port, e, f"Error syncing device {device.ip}: {str(e)}", "ZKTeco Single Device Sync")
         return {"success": False, "error": str(e)}
 
 
+def acquire_sync_lock(lock_key, expires_in_sec=300):
+    """
+    Atomically take a sync lock in Redis (SET NX with expiry)
+    Returns False if another worker already holds it; release with frappe.cache().delete_value
+    """
+    cache = frappe.cache()
+    return bool(cache.set(cache.make_key(lock_key), "locked", nx=True, ex=expires_in_sec))
+
+
+def log_device_error(ip, port, exc, message, title):
+    """
+    Record a device sync failure without flooding Error Log
+    Unreachable devices are an expected condition and only go to the logger; other
+    errors are written to Error Log at most once per ERROR_LOG_INTERVAL per device and error type
+    """
+    if isinstance(exc, _UNREACHABLE_ERRORS):
+        frappe.logger().warning(message)
+        return
+
+    key = f"zkteco_error_logged_{ip}_{port}_{type(exc).__name__}"
+    if frappe.cache().get_value(key):
+        return
+
+    frappe.cache().set_value(key, 1, expires_in_sec=ERROR_LOG_INTERVAL)
+    frappe.log_error(message, title)
+
+
 def device_mode_sync_single(device):
     """
     Device mode sync for a single device
     """
     # Implement lock mechanism to prevent concurrent execution
-    lock_key = f"zkteco_device_sync_lock_{device['ip']}_{device['port']}"
-    if frappe.cache().get_value(lock_key):
-        return {"success": False, "message": f"Device {device['ip']}:{device['port']} sync already running"}
+    lock_key = f"zkteco_device_sync_lock_{device.ip}_{device.port}"
+    if not acquire_sync_lock(lock_key):
+        return {"success": False, "message": f"Device {device.ip}:{device.port} sync already running"}
 
     try:
-        # Acquire lock with 5 minute timeout
-        frappe.cache().set_value(lock_key, "locked", expires_in_sec=300)
-
-        ip = device["ip"]
-        port = int(str(device["port"] or "4370").strip())
+        ip = device.ip
+        port = int(str(device.port or "4370").strip())
         if port != 4370:
             return {"success": False, "message": "Device mode only supports port 4370"}
 
@@ -382,19 +529,25 @@ def device_mode_sync_single(device):
         frappe.logger().info(f"Device mode: Got {len(transactions)} transactions for {ip}:{port}, applying sequence adjustment")
         transactions = adjust_checkin_sequence(transactions)
 
-        # Create checkins with adjusted log types
-        created = 0
+        # Create checkins with adjusted log types in one batch; employee codes
+        # are resolved together instead of once per punch
+        employees = find_employees_by_codes(t.get("emp_code") for t in transactions)
+        rows = []
         for transaction in transactions:
-            if create_checkin_from_attendance_v2(transaction, f"{ip}:{port}"):
-                created += 1
+            checkin_data = build_checkin_from_attendance(transaction, f"{ip}:{port}", employees)
+            if checkin_data:
+                rows.append(checkin_data)
+
+        inserted = bulk_create_checkins(rows)
+        created = len(inserted)
+        in_count = sum(1 for row in inserted if row["log_type"] == "IN")
 
         # Update device-specific sync stats
-        update_device_sync_stats(device["ip"], device["port"], created)
+        update_device_sync_stats(device.ip, device.port, created)
 
-        frappe.logger().info(f"Device mode sync completed for {ip}:{port}: {created} records created")
-        return {"success": True, "created": created}
+        return {"success": True, "created": created, "in_count": in_count, "out_count": created - in_count}
     except Exception as e:
-        frappe.log_error(f"Device mode sync failed for {device['ip']}:{device['port']}: {str(e)}", "ZKTeco Device Sync Error")
+        log_device_error(device.ip, device.port, e, f"Device mode sync failed for {device.ip}:{device.port}: {str(e)}", "ZKTeco Device Sync Error")
         return {"success": False, "message": str(e)}
     finally:
         # Always release lock when done
@@ -407,12 +560,12 @@ def api_mode_sync_single(device):
     """
     try:
         # Build API URL for this specific device
-        url = build_api_url(device["ip"], device["port"], "/attlog/get")
+        url = build_api_url(device.ip, device.port, "/attlog/get")
         
         # Prepare headers with token if available
         headers = {"Content-Type": "application/json"}
-        if device["token"]:
-            headers["Authorization"] = f"Bearer {device['token']}"
+        if device.token:
+            headers["Authorization"] = f"Bearer {device.token}"
         
         # Get today's date for filtering
         today_date = today()
@@ -426,7 +579,7 @@ def api_mode_sync_single(device):
         }
         
         # Make API request
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        response = _SESSION.post(url, json=payload, headers=headers, timeout=30)
         
         if response.status_code != 200:
             return {
@@ -439,46 +592,59 @@ def api_mode_sync_single(device):
         data = response.json()
         transactions = data.get("data", [])
         
-        # Process each transaction
-        created = 0
+        # Parse every transaction, then insert them in one batch; employee
+        # codes are resolved together instead of once per transaction
+        employees = find_employees_by_codes(get_transaction_emp_code(t) for t in transactions)
+        rows = []
         for transaction in transactions:
             # Add device-specific information to transaction
-            transaction["device_id"] = f"{device['ip']}:{device['port']}"
-            if create_employee_checkin(transaction):
-                created += 1
+            transaction["device_id"] = f"{device.ip}:{device.port}"
+            checkin_data = build_employee_checkin(transaction, employees)
+            if checkin_data:
+                rows.append(checkin_data)
+
+        inserted = bulk_create_checkins(rows)
+        created = len(inserted)
+        in_count = sum(1 for row in inserted if row["log_type"] == "IN")
         
         # Update device-specific sync stats
-        update_device_sync_stats(device["ip"], device["port"], created)
+        update_device_sync_stats(device.ip, device.port, created)
         
-        return {"success": True, "created": created, "total_transactions": len(transactions)}
+        return {
+            "success": True,
+            "created": created,
+            "in_count": in_count,
+            "out_count": created - in_count,
+            "total_transactions": len(transactions)
+        }
     except Exception as e:
-        frappe.log_error(f"API mode sync failed for {device['ip']}:{device['port']}: {str(e)}", "ZKTeco API Sync Error")
+        log_device_error(device.ip, device.port, e, f"API mode sync failed for {device.ip}:{device.port}: {str(e)}", "ZKTeco API Sync Error")
         return {"success": False, "message": str(e)}
 
 
 def update_device_sync_stats(ip, port, count):
     """
     Update sync statistics for a specific device
+    Plain UPDATEs instead of loading and saving the whole config; the caller commits
     """
     try:
-        config = frappe.get_doc("ZKTeco Config")
-        
-        # Find the device in multi_ip table
-        for ip_entry in config.multi_ip:
-            if ip_entry.ip == ip and ip_entry.port == port:
-                # Update the sync stats
-                ip_entry.last_sync = now_datetime()
-                new_count = (ip_entry.total_records_synced or 0) + count
-                ip_entry.total_records_synced = new_count
-                break
-        
-        # Update global stats
-        total_synced = (config.total_synced_records or 0) + count
-        config.total_synced_records = total_synced
-        config.last_sync = now_datetime()
-        
-        config.save(ignore_permissions=True)
-        frappe.db.commit()
+        now = now_datetime()
+
+        # Per-device stats on the multi-IP child row
+        frappe.db.sql(
+            """UPDATE `tabZKTeco Config IP`
+                SET last_sync = %s, total_records_synced = COALESCE(total_records_synced, 0) + %s
+                WHERE parenttype = 'ZKTeco Config' AND parent = 'ZKTeco Config' AND ip = %s AND port = %s""",
+            (now, count, ip, port)
+        )
+
+        # Global stats, incremented in place so concurrent device syncs don't overwrite each other
+        frappe.db.sql(
+            """UPDATE `tabSingles` SET value = CAST(COALESCE(value, 0) AS SIGNED) + %s
+                WHERE doctype = 'ZKTeco Config' AND field = 'total_synced_records'""",
+            (count,)
+        )
+        frappe.db.set_single_value("ZKTeco Config", "last_sync", now)
     except Exception as e:
         frappe.log_error(f"Error updating device sync stats for {ip}:{port}: {str(e)}", "ZKTeco Stats Update Error")
 
@@ -488,7 +654,7 @@ def test_connection():
     """
     Test connection to the configured server
     """
-    config = frappe.get_single("ZKTeco Config")
+    config = frappe.get_cached_doc("ZKTeco Config")
     
     # If multi-IP is configured, test the first one
     if config.multi_ip and len(config.multi_ip) > 0:
@@ -549,7 +715,7 @@ def test_connection():
         }
         
         # Make API request
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        response = _SESSION.post(url, json=payload, headers=headers, timeout=30)
         
         if response.status_code == 200:
             data = response.json()
@@ -606,7 +772,7 @@ def register_api_token(server_ip=None, server_port=None, username=None, password
         }
         
         # Make API request to register token
-        response = requests.post(url, json=credentials, timeout=30)
+        response = _SESSION.post(url, json=credentials, timeout=30)
         
         if response.status_code == 200:
             data = response.json()
@@ -631,42 +797,26 @@ def adjust_checkin_sequence(transactions):
     """
     Adjust checkin sequence to ensure proper IN/OUT alternation for each employee
     """
-    from collections import defaultdict
-    
-    # Group transactions by employee
-    emp_transactions = defaultdict(list)
-    for transaction in transactions:
-        emp_code = transaction.get('emp_code', 'unknown')
-        punch_time = transaction.get('punch_time') or transaction.get('timestamp')
-        
-        if punch_time and emp_code != 'unknown':
-            # Add punch_time for sorting purposes
-            transaction['_punch_time'] = punch_time
-            emp_transactions[emp_code].append(transaction)
-    
-    # Process each employee's transactions
-    for emp_code, emp_txns in emp_transactions.items():
-        # Sort by punch time
-        emp_txns.sort(key=lambda x: x['_punch_time'])
-        
-        # Assign alternating IN/OUT starting with IN
+    def punch_time(transaction):
+        return transaction.get('punch_time') or transaction.get('timestamp')
+
+    result = [
+        transaction for transaction in transactions
+        if punch_time(transaction) and transaction.get('emp_code', 'unknown') != 'unknown'
+    ]
+
+    # One sort by (employee, time) makes each employee's punches contiguous and ordered
+    result.sort(key=lambda x: (str(x['emp_code']), punch_time(x)))
+
+    # Assign alternating IN/OUT starting with IN
+    for emp_code, emp_txns in groupby(result, key=lambda x: str(x['emp_code'])):
         for i, transaction in enumerate(emp_txns):
             transaction['log_type'] = 'IN' if i % 2 == 0 else 'OUT'
             transaction['_sequence_adjusted'] = True  # Mark as adjusted
-    
-    # Flatten the list back to original format
-    result = []
-    for emp_txns in emp_transactions.values():
-        result.extend(emp_txns)
-    
+
     # Sort by original punch time
-    result.sort(key=lambda x: x['_punch_time'])
-    
-    # Remove temporary fields
-    for transaction in result:
-        if '_punch_time' in transaction:
-            del transaction['_punch_time']
-    
+    result.sort(key=punch_time)
+
     return result
 
 
@@ -674,48 +824,48 @@ def create_employee_checkin(transaction):
     """
     Create Employee Checkin from transaction data
     """
+    checkin_data = build_employee_checkin(transaction)
+    if not checkin_data:
+        return False
+
+    bulk_create_checkins([checkin_data])
+    return True
+
+
+def get_transaction_emp_code(transaction):
+    """
+    Extract employee code from various possible fields
+    """
+    return (
+        transaction.get('emp_code') or
+        transaction.get('user_id') or
+        transaction.get('pin') or
+        transaction.get('employee_code') or
+        transaction.get('id')
+    )
+
+
+def build_employee_checkin(transaction, employees=None):
+    """
+    Parse transaction data into Employee Checkin values without inserting anything
+    employees optionally maps employee codes to names, as returned by find_employees_by_codes
+    Returns the checkin dict, or None if the transaction can't be used
+    """
+    log = frappe.logger()
+    debug = log.isEnabledFor(logging.DEBUG)
+
     try:
-        # Extract employee code from various possible fields
-        emp_code = (
-            transaction.get('emp_code') or
-            transaction.get('user_id') or
-            transaction.get('pin') or
-            transaction.get('employee_code') or
-            transaction.get('id')
-        )
+        emp_code = get_transaction_emp_code(transaction)
 
         if not emp_code:
-            frappe.logger().warning(f"No employee code found in transaction: {json.dumps(transaction, default=str)}")
-            return False
-
-        # Extract punch time from various possible fields
-        time_fields = [
-            'punch_time', 'punchTime', 'timestamp', 'datetime',
-            'date_time', 'check_time', 'time', 'created_at'
-        ]
-
-        # Possible time format strings
-        time_formats = [
-            '%Y-%m-%d %H:%M:%S',      # 2023-12-08 14:30:45
-            '%Y-%m-%d %H:%M:%S.%f',   # 2023-12-08 14:30:45.123456
-            '%Y-%m-%d %H:%M:%S%z',    # 2023-12-08 14:30:45+0500
-            '%Y-%m-%dT%H:%M:%S',      # 2023-12-08T14:30:45
-            '%Y-%m-%dT%H:%M:%S.%f',   # 2023-12-08T14:30:45.123456
-            '%Y-%m-%dT%H:%M:%S%z',    # 2023-12-08T14:30:45+0500
-            '%Y-%m-%dT%H:%M:%SZ',     # 2023-12-08T14:30:45Z
-            '%Y-%m-%d',               # 2023-12-08
-            '%Y-%m-%d %H:%M',         # 2023-12-08 14:30
-            '%m/%d/%Y %H:%M:%S',      # 12/08/2023 14:30:45
-            '%m/%d/%Y %H:%M',         # 12/08/2023 14:30
-            '%d/%m/%Y %H:%M:%S',      # 08/12/2023 14:30:45
-            '%d/%m/%Y %H:%M',         # 08/12/2023 14:30
-        ]
+            log.warning("No employee code found in transaction with keys: %s", list(transaction.keys()))
+            return None
 
         punch_time = None
         used_field = None
 
         # Try each time field
-        for field in time_fields:
+        for field in _TIME_FIELDS:
             if field not in transaction or not transaction[field]:
                 continue
 
@@ -728,14 +878,7 @@ def create_employee_checkin(transaction):
 
             # Handle string timestamps
             if isinstance(value, str):
-                value = value.strip()
-                for fmt in time_formats:
-                    try:
-                        punch_time = datetime.strptime(value, fmt)
-                        frappe.logger().debug(f"Parsed {field} as {fmt}: {punch_time}")
-                        break
-                    except ValueError:
-                        continue
+                punch_time = _parse_punch_time(value.strip())
             # Handle numeric timestamps (UNIX timestamp in seconds or milliseconds)
             elif isinstance(value, (int, float)):
                 try:
@@ -744,26 +887,24 @@ def create_employee_checkin(transaction):
                     if ts > 1e12:  # Roughly year 2001 in milliseconds
                         ts = ts / 1000.0
                     punch_time = datetime.fromtimestamp(ts)
-                    frappe.logger().debug(f"Converted {field} from timestamp: {punch_time}")
                 except (ValueError, TypeError, OSError) as e:
-                    frappe.logger().debug(f"Failed to parse timestamp {value} from {field}: {str(e)}")
+                    if debug:
+                        log.debug("Failed to parse timestamp %s from %s: %s", value, field, e)
                     continue
             # Handle datetime objects directly
             elif hasattr(value, 'strftime'):  # Already a datetime object
                 punch_time = value
-                frappe.logger().debug(f"Using direct datetime object from {field}: {punch_time}")
                 break
 
             if punch_time is not None:
                 break
 
         if punch_time is None:
-            frappe.logger().warning(f"Could not parse punch time from transaction: {json.dumps(transaction, default=str)}")
-            return False
+            log.warning("Could not parse punch time from transaction with keys: %s", list(transaction.keys()))
+            return None
 
-        # Log which field was used for debugging
-        if used_field:
-            frappe.logger().debug(f"Using time from field: {used_field} = {punch_time}")
+        if debug:
+            log.debug("Using time from field: %s = %s", used_field, punch_time)
 
         # Ensure punch_time is timezone-naive (remove timezone info if present)
         if hasattr(punch_time, 'tzinfo') and punch_time.tzinfo is not None:
@@ -781,32 +922,29 @@ def create_employee_checkin(transaction):
 
         transaction_id = transaction.get('id') or transaction.get('transaction_id') or transaction.get('uid') or 'unknown'
 
-        # Additional logging for debugging
-        frappe.logger().debug(f"Extracted data - Emp: {emp_code}, Time: {punch_time} (type: {type(punch_time)}), Device: {device_id}, ID: {transaction_id}")
-
-        if not emp_code:
-            frappe.logger().warning(f"Missing employee code in transaction: {json.dumps(transaction, default=str)}")
-            return False
+        if debug:
+            log.debug("Extracted data - Emp: %s, Time: %s, Device: %s, ID: %s", emp_code, punch_time, device_id, transaction_id)
 
         # Validate punch time is within a reasonable range
         now = now_datetime()
         if not isinstance(punch_time, datetime):
-            frappe.logger().warning(f"Invalid punch_time type: {type(punch_time)} for transaction {transaction_id}")
-            return False
+            log.warning("Invalid punch_time type: %s for transaction %s", type(punch_time), transaction_id)
+            return None
 
         if punch_time > now + timedelta(days=1):  # Future date check (allow 1 day in future for timezone differences)
-            frappe.logger().warning(f"Future date in transaction {transaction_id}: {punch_time} (current time: {now})")
-            return False
+            log.warning("Future date in transaction %s: %s (current time: %s)", transaction_id, punch_time, now)
+            return None
 
         if (now - punch_time) > timedelta(days=90):
-            frappe.logger().warning(f"Skipping old transaction: {transaction_id} from {punch_time}")
-            return False
+            if debug:
+                log.debug("Skipping old transaction: %s from %s", transaction_id, punch_time)
+            return None
 
         # Find employee
-        employee = find_employee_by_code(emp_code)
+        employee = employees.get(str(emp_code)) if employees is not None else find_employee_by_code(emp_code)
         if not employee:
             frappe.log_error(f"Employee not found for code: {emp_code}", "ZKTeco Employee Mapping")
-            return False
+            return None
 
         # Convert punch_time to datetime
         if isinstance(punch_time, str):
@@ -823,7 +961,7 @@ def create_employee_checkin(transaction):
 
         if not punch_datetime:
             frappe.log_error(f"Could not parse punch time: {punch_time}", "ZKTeco Time Parse Error")
-            return False
+            return None
 
         # Validate timestamp is reasonable
         current_time = now_datetime()
@@ -835,42 +973,22 @@ def create_employee_checkin(transaction):
                 f"Transaction timestamp is in the future: {punch_datetime} (current: {current_time})\nTransaction: {json.dumps(transaction, default=str, ensure_ascii=False)}",
                 "ZKTeco Invalid Timestamp"
             )
-            return False
+            return None
 
         # Check if timestamp is too old
         if punch_datetime < current_time - timedelta(days=max_past_days):
-            frappe.logger().debug(
-                f"Skipping old transaction: {punch_datetime} (older than {max_past_days} days)"
-            )
-            return False
+            if debug:
+                log.debug("Skipping old transaction: %s (older than %s days)", punch_datetime, max_past_days)
+            return None
 
         # Check if log_type was already set by adjust_checkin_sequence
         if transaction.get('_sequence_adjusted') is not None and transaction.get('log_type'):
             log_type = transaction['log_type']
-            frappe.logger().info(f"Using sequence-adjusted log type: {log_type}")
         else:
-            # Log before detecting log type
-            frappe.logger().info("Detecting log type for transaction")
-            log_type = detect_log_type(transaction)
-
-            # Log the detected log type
-            if log_type:
-                frappe.logger().info(f"Detected log type: {log_type}")
-            else:
-                log_type = "IN"  # Default to "IN" if detection fails
-                frappe.logger().warning("Could not determine log type, defaulting to IN")
-
-            # Log the final log type being used
-            frappe.logger().info(f"Final log type being used: {log_type}")
+            log_type = detect_log_type(transaction) or "IN"  # Default to "IN" if detection fails
 
-            # Also log transaction keys for debugging
-            frappe.logger().info(f"Transaction keys: {list(transaction.keys())}")
-            if 'punch_state_display' in transaction:
-                frappe.logger().info(f"punch_state_display: {transaction['punch_state_display']}")
-            if 'punch_state' in transaction:
-                frappe.logger().info(f"punch_state: {transaction['punch_state']}")
-            if 'punch' in transaction:
-                frappe.logger().info(f"punch: {transaction['punch']}")
+        if debug:
+            log.debug("Log type for %s at %s: %s", emp_code, punch_datetime, log_type)
 
         # Build unique device_id with transaction ID to prevent duplicates
         unique_device_id = f"{device_id} (ZKTeco-{transaction_id})" if (device_id and transaction_id) else (device_id or f"ZKTeco-{transaction_id}" if transaction_id else "ZKTeco Device")
@@ -881,18 +999,6 @@ def create_employee_checkin(transaction):
         # Create a more precise timestamp for the checkin (including seconds)
         checkin_time = punch_datetime.strftime('%Y-%m-%d %H:%M:%S')
 
-        # Check if checkin already exists - include log_type to allow both IN and OUT for same employee/time
-        existing_checkin = frappe.db.get_value("Employee Checkin", {
-            "employee": employee,
-            "time": ["=", checkin_time],
-            "log_type": log_type,
-            "device_id": ["like", f"%{device_id}%" if device_id else "%ZKTeco%"]
-        }, ['name', 'device_id', 'log_type'], as_dict=1)
-
-        if existing_checkin:
-            frappe.logger().debug(f"Skipping duplicate checkin: {employee} at {checkin_time} ({log_type}) - {existing_checkin}")
-            return True  # Already processed
-
         # Create Employee Checkin
         checkin_data = {
             "doctype": "Employee Checkin",
@@ -908,25 +1014,57 @@ def create_employee_checkin(transaction):
             if field in transaction and transaction[field]:
                 checkin_data[f'zkteco_{field}'] = str(transaction[field])
 
-        # Log the checkin data for debugging
-        frappe.logger().debug(f"Creating checkin: {json.dumps(checkin_data, default=str)}")
+        return checkin_data
 
-        checkin = frappe.get_doc(checkin_data)
-        checkin.insert(ignore_permissions=True, ignore_if_duplicate=True)
-        frappe.db.commit()
-
-        frappe.logger().info(f"Created {log_type} checkin for employee {employee} at {checkin_time}")
-        return True
-
-    except frappe.DuplicateEntryError as e:
-        frappe.logger().debug(f"Duplicate checkin detected and skipped: {str(e)}")
-        frappe.db.rollback()
-        return True
     except Exception as e:
         error_msg = f"Error creating Employee Checkin: {str(e)}\nTransaction: {json.dumps(transaction, default=str, ensure_ascii=False)}"
         frappe.log_error(error_msg, "ZKTeco Checkin Creation Error")
-        frappe.db.rollback()
-        return False
+        return None
+
+
+def bulk_create_checkins(rows):
+    """
+    Insert many Employee Checkins with one duplicate lookup and a single commit
+    Rows already present (same employee, time and log type) are skipped
+    Returns the list of rows that were inserted
+    """
+    if not rows:
+        return []
+
+    for row in rows:
+        row["time"] = get_datetime(row["time"]).replace(microsecond=0)
+
+    # One query covers the duplicate check for the whole batch; the
+    # (employee, time) index keeps it a range scan
+    times = [row["time"] for row in rows]
+    existing = {
+        (r.employee, r.time, r.log_type)
+        for r in frappe.db.sql(
+            """SELECT employee, time, log_type FROM `tabEmployee Checkin`
+                WHERE employee IN %(employees)s AND time BETWEEN %(from_time)s AND %(to_time)s""",
+            {"employees": tuple({row["employee"] for row in rows}), "from_time": min(times), "to_time": max(times)},
+            as_dict=True
+        )
+    }
+
+    inserted = []
+    for row in rows:
+        key = (row["employee"], row["time"], row["log_type"])
+        if key in existing:
+            continue
+        existing.add(key)
+
+        try:
+            frappe.get_doc({"doctype": "Employee Checkin", **row}).insert(ignore_permissions=True, ignore_if_duplicate=True)
+            inserted.append(row)
+        except Exception as e:
+            frappe.log_error(
+                f"Error creating Employee Checkin for {row['employee']} at {row['time']}: {str(e)}",
+                "ZKTeco Checkin Creation Error"
+            )
+
+    frappe.db.commit()
+    return inserted
 
 
 @frappe.whitelist()
@@ -934,9 +1072,6 @@ def test_transaction_parsing(transaction_json):
     """
     Test how a transaction will be parsed
     """
-    import json
-    from frappe.utils import now_datetime
-    
     try:
         if isinstance(transaction_json, str):
             transaction = json.loads(transaction_json)
@@ -1022,6 +1157,44 @@ def find_employee_by_code(emp_code):
     return None
 
 
+def employee_code_key(code):
+    """
+    Key for matching a device's employee code against Employee fields the way
+    the database's case-insensitive collation does, ignoring surrounding spaces
+    """
+    return str(code).strip().casefold()
+
+
+def find_employees_by_codes(emp_codes):
+    """
+    Resolve many employee codes at once with the same field precedence as find_employee_by_code
+    Returns a dict of code -> Employee name; one query per ID field instead of per code
+    """
+    codes = {str(code) for code in emp_codes if code}
+    employees = {}
+
+    # The database matches codes case-insensitively, so rows are mapped back
+    # to the device's own codes by normalized key, which callers look up by
+    codes_by_key = {}
+    for code in codes:
+        codes_by_key.setdefault(employee_code_key(code), []).append(code)
+
+    fields = ["employee", "user_id"]
+    if frappe.db.has_column("Employee", "attendance_device_id"):
+        fields.append("attendance_device_id")
+
+    for field in fields:
+        remaining = codes - employees.keys()
+        if not remaining:
+            break
+
+        for row in frappe.get_all("Employee", filters={field: ["in", list(remaining)]}, fields=["name", field]):
+            for code in codes_by_key.get(employee_code_key(row[field]), ()):
+                employees.setdefault(code, row.name)
+
+    return employees
+
+
 @frappe.whitelist()
 def test_sync_with_sample_data():
     """
@@ -1079,7 +1252,7 @@ def manual_sync():
     Manual sync trigger for testing
     """
     try:
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         if cfg.sync_method == "Individual":
             # Sync each device individually
             results = sync_all_devices()
@@ -1099,8 +1272,10 @@ def scheduled_sync():
     """
     Scheduled sync function that respects the frequency setting
     """
+    cleanup_scheduler_check()
+
     try:
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         if not cfg.enable_sync:
             return
             
@@ -1137,7 +1312,7 @@ def cleanup_scheduler_check():
     Cleanup function to ensure scheduler is working properly
     """
     try:
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         if cfg.enable_sync:
             # Log that the scheduler is active
             frappe.logger().info("ZKTeco scheduler check: Active")
@@ -1229,13 +1404,10 @@ def set_config(server_ip: str, server_port: str | int, enable_sync: int = 1, sec
 def device_mode_sync():
     # Implement lock mechanism to prevent concurrent execution
     lock_key = "zkteco_device_sync_lock"
-    if frappe.cache().get_value(lock_key):
+    if not acquire_sync_lock(lock_key):
         return {"success": False, "message": "Device sync already running"}
 
     try:
-        # Acquire lock with 5 minute timeout
-        frappe.cache().set_value(lock_key, "locked", expires_in_sec=300)
-
         cfg = frappe.get_single("ZKTeco Config")
         ip = cfg.server_ip
         port = int(str(cfg.server_port or "4370").strip())
@@ -1270,11 +1442,16 @@ def device_mode_sync():
         frappe.logger().info(f"Device mode: Got {len(transactions)} transactions, applying sequence adjustment")
         transactions = adjust_checkin_sequence(transactions)
 
-        # Create checkins with adjusted log types
-        created = 0
+        # Create checkins with adjusted log types in one batch; employee codes
+        # are resolved together instead of once per punch
+        employees = find_employees_by_codes(t.get("emp_code") for t in transactions)
+        rows = []
         for transaction in transactions:
-            if create_checkin_from_attendance_v2(transaction, f"{ip}:{port}"):
-                created += 1
+            checkin_data = build_checkin_from_attendance(transaction, f"{ip}:{port}", employees)
+            if checkin_data:
+                rows.append(checkin_data)
+
+        created = len(bulk_create_checkins(rows))
 
         frappe.db.set_single_value("ZKTeco Config", "last_sync", now_datetime())
         total_synced = frappe.db.get_single_value("ZKTeco Config", "total_synced_records") or 0
@@ -1284,7 +1461,7 @@ def device_mode_sync():
         frappe.logger().info(f"Device mode sync completed: {created} records created")
         return {"success": True, "created": created}
     except Exception as e:
-        frappe.log_error(f"Device mode sync failed: {str(e)}", "ZKTeco Device Sync Error")
+        log_device_error("primary", 4370, e, f"Device mode sync failed: {str(e)}", "ZKTeco Device Sync Error")
         return {"success": False, "message": str(e)}
     finally:
         # Always release lock when done
@@ -1349,69 +1526,55 @@ def create_checkin_from_attendance_v2(transaction, device_id):
     """
     Create checkin from transaction dict (used after sequence adjustment)
     """
-    try:
-        emp_code = transaction.get("emp_code")
-        if not emp_code:
-            return False
-
-        employee = find_employee_by_code(emp_code)
-        if not employee:
-            frappe.logger().debug(f"Employee not found for code: {emp_code}")
-            return False
-
-        punch_datetime = transaction.get("punch_time") or transaction.get("timestamp")
-        if not punch_datetime:
-            return False
-
-        # Validate timestamp is reasonable
-        current_time = now_datetime()
-        max_past_days = 90
+    checkin_data = build_checkin_from_attendance(transaction, device_id)
+    if not checkin_data:
+        return False
 
-        # Check if timestamp is in the future
-        if punch_datetime > current_time + timedelta(minutes=5):
-            return False
+    bulk_create_checkins([checkin_data])
+    return True
 
-        # Check if timestamp is too old
-        if punch_datetime < current_time - timedelta(days=max_past_days):
-            return False
 
-        # Use log_type from adjusted sequence (this is the key fix!)
-        log_type = transaction.get("log_type", "IN")
+def build_checkin_from_attendance(transaction, device_id, employees=None):
+    """
+    Build checkin values from a sequence-adjusted transaction dict
+    employees optionally maps employee codes to names, as returned by find_employees_by_codes
+    Returns the checkin dict, or None if the transaction can't be used
+    """
+    emp_code = transaction.get("emp_code")
+    if not emp_code:
+        return None
 
-        # Log the action for debugging
-        frappe.logger().debug(f"Creating {log_type} checkin for {employee} at {punch_datetime}")
+    employee = employees.get(str(emp_code)) if employees is not None else find_employee_by_code(emp_code)
+    if not employee:
+        log = frappe.logger()
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Employee not found for code: %s", emp_code)
+        return None
 
-        # Check for existing record with same time and log_type
-        existing = frappe.db.exists("Employee Checkin", {
-            "employee": employee,
-            "time": punch_datetime,
-            "device_id": device_id,
-            "log_type": log_type
-        })
+    punch_datetime = transaction.get("punch_time") or transaction.get("timestamp")
+    if not punch_datetime:
+        return None
 
-        if existing:
-            frappe.logger().debug(f"Duplicate found, skipping: {employee} at {punch_datetime} ({log_type})")
-            return True
+    # Validate timestamp is reasonable
+    current_time = now_datetime()
+    max_past_days = 90
 
-        # Create the checkin
-        checkin = frappe.get_doc({
-            "doctype": "Employee Checkin",
-            "employee": employee,
-            "time": punch_datetime,
-            "log_type": log_type,
-            "device_id": device_id,
-            "skip_auto_attendance": 0
-        })
-        checkin.insert(ignore_permissions=True)
-        frappe.db.commit()
+    # Check if timestamp is in the future
+    if punch_datetime > current_time + timedelta(minutes=5):
+        return None
 
-        frappe.logger().info(f"✅ Created {log_type} checkin for {employee} at {punch_datetime}")
-        return True
+    # Check if timestamp is too old
+    if punch_datetime < current_time - timedelta(days=max_past_days):
+        return None
 
-    except Exception as e:
-        frappe.logger().error(f"Error creating checkin: {str(e)}")
-        frappe.db.rollback()
-        return False
+    return {
+        "employee": employee,
+        "time": punch_datetime,
+        # Use log_type from adjusted sequence (this is the key fix!)
+        "log_type": transaction.get("log_type", "IN"),
+        "device_id": device_id,
+        "skip_auto_attendance": 0
+    }
 
 
 @frappe.whitelist()
@@ -0,0 +1,9 @@
+import frappe
+
+
+def execute():
+    """
+    Add the (employee, time, log_type) index used by the sync's duplicate
+    checks and the prefetch of existing checkins for a batch
+    """
+    frappe.db.add_index("Employee Checkin", ["employee", "time", "log_type"], index_name="idx_zkt_checkin_dedup")
@@ -0,0 +1,23 @@
+import frappe
+
+
+def execute():
+    """
+    Rebuild idx_zkt_checkin_source as (source, creation, log_type) on sites that
+    got it as (source, log_type, creation). With log_type second, get_sync_status's
+    creation range could not be used for a seek and every ZKTeco checkin's index
+    entry was read on each status call
+    """
+    columns = [
+        row.Column_name
+        for row in frappe.db.sql(
+            "SHOW INDEX FROM `tabEmployee Checkin` WHERE Key_name = 'idx_zkt_checkin_source'",
+            as_dict=True
+        )
+    ]
+    if columns[:2] == ["source", "creation"]:
+        return
+
+    if columns:
+        frappe.db.sql_ddl("ALTER TABLE `tabEmployee Checkin` DROP INDEX `idx_zkt_checkin_source`")
+    frappe.db.add_index("Employee Checkin", ["source", "creation", "log_type"], index_name="idx_zkt_checkin_source")
@@ -5,23 +5,221 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from frappe.utils import today, now_datetime, get_datetime, flt, cint
 from datetime import datetime, timedelta
 import json
+import logging
+import errno
+import re
+import select
 import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache, lru_cache
+from itertools import groupby
+from operator import itemgetter
+from math import ceil
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+# Transaction pages can be several MB; orjson (shipped with Frappe) decodes
+# them much faster and serializes datetimes for logs natively
 try:
-    from zk import ZK
-except Exception:
-    ZK = None
+    import orjson
+except ImportError:
+    orjson = None
+_json_loads = orjson.loads if orjson else json.loads
+
+# Shared HTTP session for API mode: keeps TCP/TLS connections to the ZKTeco
+# server alive across pages and syncs. Gateway errors are retried, and the
+# last response is returned rather than raised so callers see the status.
+# One pool is kept per host, enough for every API device of a multi-device
+# sync, so devices don't evict each other's kept-alive connections
+_SESSION = requests.Session()
+_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate", "User-Agent": "zkteco-checkins-sync"})
+_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=10,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504], allowed_methods=None, raise_on_status=False)
+)
+_SESSION.mount("http://", _adapter)
+_SESSION.mount("https://", _adapter)
+
+# Concurrent page requests in fetch_zkteco_transactions when page URLs can be predicted
+FETCH_PAGE_WORKERS = 4
+
+# check_device_status results reused for this many seconds, keyed by (ip, port).
+# The endpoint is whitelisted, so expired entries are pruned on every write and
+# the cache never holds more than DEVICE_STATUS_CACHE_SIZE devices
+DEVICE_STATUS_TTL = 2.0
+DEVICE_STATUS_CACHE_SIZE = 256
+_DEVICE_STATUS_CACHE = {}
+
+# Seconds probe_device waits for a device's TCP port to accept a connection
+DEVICE_PROBE_TIMEOUT = 5
+
+# Checkins are inserted inside one transaction per sync and committed every
+# BATCH_COMMIT_SIZE rows, so a large backlog never holds one huge transaction
+BATCH_COMMIT_SIZE = 500
+
+# Stored in Employee Checkin.source on every synced checkin, see the
+# add_checkin_source_field patch
+CHECKIN_SOURCE = "ZKTeco"
+
+# Punches older than this are not synced; clocks may run up to FUTURE_TOLERANCE ahead
+MAX_PAST_DAYS = 90
+FUTURE_TOLERANCE = timedelta(minutes=5)
+_EPOCH = datetime(1970, 1, 1)
+
+# Longest transaction dump written into an Error Log entry
+TRANSACTION_EXCERPT_LENGTH = 512
+
+# Open device mode connections reused across syncs in the same process, keyed by (ip, port)
+_ZK_CONNECTIONS = {}
+# One lock per device, so reads from different devices can run in parallel
+_ZK_LOCKS = {}
+_ZK_LOCK = threading.Lock()
+# Seconds a device socket waits on connect and on each reply. Devices are read
+# in parallel, so an offline device only holds up its own worker this long
+DEVICE_TIMEOUT = 5
+
+# Devices fetched concurrently by sync_multiple_devices
+MAX_DEVICE_WORKERS = 8
+
+# Names per DELETE statement in remove_duplicate_checkins, keeps each IN (...) list bounded
+DELETE_CHUNK_SIZE = 5000
+# Names per UPDATE statement in fix_existing_checkins
+UPDATE_CHUNK_SIZE = 1000
+# (name, correct log type) for checkins whose log_type breaks the IN/OUT sequence
+# of their employee's day, numbered by time with name as tiebreak
+FIX_LOG_TYPE_QUERY = """
+    SELECT name, correct_log_type FROM (
+        SELECT name, log_type,
+            CASE
+                WHEN cnt = 1 THEN 'IN'
+                WHEN rn = cnt THEN 'OUT'
+                WHEN MOD(rn, 2) = 1 THEN 'IN'
+                ELSE 'OUT'
+            END AS correct_log_type
+        FROM (
+            SELECT name, log_type,
+                ROW_NUMBER() OVER (PARTITION BY employee, CAST(time AS DATE) ORDER BY time, name) AS rn,
+                COUNT(*) OVER (PARTITION BY employee, CAST(time AS DATE)) AS cnt
+            FROM `tabEmployee Checkin`
+            WHERE device_id LIKE %(device_id)s
+        ) numbered
+    ) classified
+    WHERE NOT (log_type <=> correct_log_type)
+"""
+
+# Names of device mode checkins repeating an earlier (employee, time, log_type),
+# keeping the first one created
+DUPLICATE_CHECKINS_QUERY = """
+    SELECT name FROM (
+        SELECT name,
+            ROW_NUMBER() OVER (PARTITION BY employee, time, log_type ORDER BY creation, name) AS rn
+        FROM `tabEmployee Checkin`
+        WHERE device_id LIKE %(device_id)s
+    ) numbered
+    WHERE rn > 1
+"""
+
+# Known log type fields checked by detect_log_type before any pattern search,
+# as (field_name, is_numeric, out_value, in_value); string values are upper case
+_FIELD_CHECKS = (
+    ('log_type', False, 'OUT', 'IN'),
+    ('punch_state', True, 1, 0),
+    ('punch', True, 1, 0),
+    ('punchtype', True, 1, 0),
+    ('type', False, 'OUT', 'IN'),
+    ('direction', False, 'OUT', 'IN'),
+    ('status', False, 'OUT', 'IN'),
+    ('verify_type', True, 1, 0),
+)
+
+# IN/OUT indicators searched for in casefolded transaction values by
+# detect_log_type: out, check out, checkout, chk out, chkout, outgoing, exit
+# and the Urdu display text, and likewise in, check in, checkin, chk in,
+# chkin, entry. Plain lower case alternations, no per-character re.I folding
+_OUT_RE = re.compile("out|exit|چیک ?آؤٹ")
+_IN_RE = re.compile("in|entry|چیک ?ان")
+
+# Exact punch_state_display texts sent by the device, casefolded, so the
+# common case is one dict lookup before any pattern search
+_DISPLAY_LOG_TYPES = {
+    "check in": "IN",
+    "checkin": "IN",
+    "in": "IN",
+    "چیک ان": "IN",
+    "check out": "OUT",
+    "checkout": "OUT",
+    "out": "OUT",
+    "چیک آؤٹ": "OUT",
+}
+
+# Fields a transaction may carry the employee code in, in order of preference
+EMP_CODE_FIELDS = ('emp_code', 'employee_code', 'employee_no')
+
+# Fields adjust_checkin_sequence reads the punch time from, in order of preference
+SEQUENCE_TIME_FIELDS = ('punch_time', 'punchTime', 'punchtime', 'timestamp', 'time')
+
+# Fields build_checkin_data reads the punch time from, in order of preference
+CHECKIN_TIME_FIELDS = (
+    'punch_time', 'punchTime', 'punchtime', 'time',
+    'timestamp', 'punchTimeStr', 'checktime', 'record_time'
+)
+
+# Fields naming the device and the transaction itself, in order of preference
+DEVICE_ID_FIELDS = ('terminal_alias', 'terminal_sn', 'device_alias', 'device_id')
+TRANSACTION_ID_FIELDS = ('id', 'transaction_id', 'uid')
+
+# build_checkin_data skip reasons that are written to the Error Log, with the
+# log title, and how many of a batch's skipped transactions each entry lists.
+# "error" collects checkins that failed to insert
+SKIP_ERROR_TITLES = {
+    "future": "ZKTeco Invalid Timestamp",
+    "unknown_employee": "ZKTeco Employee Mapping",
+    "error": "ZKTeco Sync Error",
+}
+SKIP_ERROR_DETAILS = 50
+
+# strptime formats tried for punch time strings datetime.fromisoformat can't read
+_TIME_FORMATS = (
+    '%Y-%m-%d %H:%M:%S',    # 2023-12-08 14:30:45
+    '%Y-%m-%dT%H:%M:%S',    # 2023-12-08T14:30:45
+    '%Y-%m-%d %H:%M',       # 2023-12-08 14:30
+    '%Y-%m-%d',             # 2023-12-08
+    '%Y/%m/%d %H:%M:%S',    # 2023/12/08 14:30:45
+    '%d-%m-%Y %H:%M:%S',    # 08-12-2023 14:30:45
+    '%d/%m/%Y %H:%M:%S',    # 08/12/2023 14:30:45
+    '%Y%m%d%H%M%S',         # 20231208143045
+    '%Y%m%d',               # 20231208
+    '%d.%m.%Y %H:%M:%S',    # 08.12.2023 14:30:45
+    '%b %d %Y %H:%M:%S',    # Dec 08 2023 14:30:45
+    '%b %d %Y %H:%M:%S.%f', # Dec 08 2023 14:30:45.123456
+    '%Y-%m-%d %H:%M:%S.%f', # 2023-12-08 14:30:45.123456
+    '%Y-%m-%d %H:%M:%S%z',  # 2023-12-08 14:30:45+0500
+    '%Y-%m-%dT%H:%M:%S%z',  # 2023-12-08T14:30:45+0500
+)
+# The _TIME_FORMATS entry that parsed the previous non-ISO punch time, tried
+# first since a device reports every punch in the same format
+_last_time_format = None
+
+# (site, emp_code) -> Employee name or None, reset and warmed at the start of
+# every sync batch by warm_employee_cache
+_EMPLOYEE_CACHE = {}
 
 
 class ZKTecoConfig(Document):
     pass
 
 
+@lru_cache(maxsize=64)
 def build_api_url(server_ip, server_port, endpoint="", use_https=None):
     """
-    Build API URL with proper protocol (HTTP/HTTPS)
+    Build API URL with proper protocol (HTTP/HTTPS). Cached: the same few
+    device addresses and endpoints are built on every sync and check
 
     Args:
         server_ip: Server IP address
@@ -37,7 +235,7 @@ def build_api_url(server_ip, server_port, endpoint="", use_https=None):
         # Common HTTPS ports: 443, 8443
         # Common HTTP ports: 80, 8080, 4370
         port_int = int(str(server_port).strip())
-        use_https = port_int in [443, 8443]
+        use_https = port_int in (443, 8443)
 
     protocol = "https" if use_https else "http"
     base_url = f"{protocol}://{server_ip}:{server_port}"
@@ -56,120 +254,88 @@ def detect_log_type(transaction):
     Intelligently detect if transaction is IN or OUT
     Checks multiple possible fields from ZKTeco
     """
-    # Log the raw transaction for debugging
-    frappe.logger().info("===== DETECT_LOG_TYPE START =====")
-    frappe.logger().info(f"Transaction data: {json.dumps(transaction, default=str, ensure_ascii=False, indent=2)}")
-    
-    # First, check for any field that might contain 'IN' or 'OUT' directly
-    for key, value in transaction.items():
-        if not value and value not in [0, False]:
-            continue
-            
-        value_str = str(value).upper().strip()
-        
-        # Check for OUT indicators
-        out_indicators = ['OUT', 'CHECK OUT', 'CHECKOUT', 'CHK OUT', 'CHKOUT', 'OUTGOING', 'EXIT']
-        if any(x in value_str for x in out_indicators):
-            frappe.logger().info(f"✅ Found OUT indicator in field '{key}': {value}")
-            return "OUT"
-            
-        # Check for IN indicators
-        in_indicators = ['IN', 'CHECK IN', 'CHECKIN', 'CHK IN', 'CHKIN', 'ENTRY']
-        if any(x in value_str for x in in_indicators):
-            frappe.logger().info(f"✅ Found IN indicator in field '{key}': {value}")
-            return "IN"
-    
-    # Try specific known fields with standard processing
-    field_checks = [
-        # (field_name, is_numeric, out_value, in_value)
-        ('log_type', False, 'OUT', 'IN'),
-        ('punch_state', True, 1, 0),
-        ('punch', True, 1, 0),
-        ('punchtype', True, 1, 0),
-        ('type', False, 'OUT', 'IN'),
-        ('direction', False, 'OUT', 'IN'),
-        ('status', False, 'OUT', 'IN'),
-        ('verify_type', True, 1, 0),
-    ]
+    # Fast path: the API reliably sends a numeric punch_state (0 = IN, 1 = OUT).
+    # An explicit log_type still takes precedence, as in _FIELD_CHECKS
+    punch_state = transaction.get('punch_state')
+    if punch_state is not None and transaction.get('log_type') is None:
+        try:
+            punch_state = int(punch_state)
+        except (TypeError, ValueError):
+            pass
+        else:
+            if punch_state == 0:
+                return "IN"
+            if punch_state == 1:
+                return "OUT"
+
+    # Called once per transaction: only build debug messages when they will be emitted
+    log = frappe.logger()
+    is_debug = log.isEnabledFor(logging.DEBUG)
+    if is_debug:
+        log.debug("Detecting log type for transaction %s (emp_code: %s)", transaction.get('id'), transaction.get('emp_code'))
     
-    frappe.logger().info("Checking standard fields...")
-    for field, is_numeric, out_val, in_val in field_checks:
-        if field not in transaction or transaction[field] is None:
-            frappe.logger().debug(f"Field '{field}' not found in transaction")
+    # Try specific known fields with standard processing first, each is a
+    # single key lookup, before scanning every value for indicators
+    for field, is_numeric, out_val, in_val in _FIELD_CHECKS:
+        value = transaction.get(field)
+        if value is None:
             continue
             
         try:
             if is_numeric:
                 # Handle numeric fields
-                val = int(transaction[field])
+                val = int(value)
                 if val == out_val:
-                    frappe.logger().info(f"✅ Using numeric field '{field}': {val} -> OUT")
+                    if is_debug:
+                        log.debug("Using numeric field '%s': %s -> OUT", field, val)
                     return "OUT"
                 elif val == in_val:
-                    frappe.logger().info(f"✅ Using numeric field '{field}': {val} -> IN")
+                    if is_debug:
+                        log.debug("Using numeric field '%s': %s -> IN", field, val)
                     return "IN"
-                else:
-                    frappe.logger().debug(f"Numeric field '{field}' value {val} doesn't match OUT ({out_val}) or IN ({in_val})")
             else:
                 # Handle string fields
-                val = str(transaction[field]).upper().strip()
-                out_val_upper = str(out_val).upper()
-                in_val_upper = str(in_val).upper()
+                val = str(value).upper().strip()
                 
-                if val == out_val_upper:
-                    frappe.logger().info(f"✅ Using string field '{field}': {val} -> OUT")
+                if val == out_val:
+                    if is_debug:
+                        log.debug("Using string field '%s': %s -> OUT", field, val)
                     return "OUT"
-                elif val == in_val_upper:
-                    frappe.logger().info(f"✅ Using string field '{field}': {val} -> IN")
+                elif val == in_val:
+                    if is_debug:
+                        log.debug("Using string field '%s': %s -> IN", field, val)
                     return "IN"
-                else:
-                    frappe.logger().debug(f"String field '{field}' value '{val}' doesn't match OUT ('{out_val_upper}') or IN ('{in_val_upper}')")
         except (ValueError, TypeError) as e:
-            frappe.logger().warning(f"Error processing field '{field}': {str(e)}")
-    
-    # Check for punch_state_display (text) - common in ZKTeco
-    punch_state_display = str(transaction.get('punch_state_display', '')).lower().strip()
-    if punch_state_display:
-        frappe.logger().info(f"Checking punch_state_display: '{punch_state_display}'")
-        out_indicators = ['out', 'check out', 'checkout', 'چیک آؤٹ']
-        in_indicators = ['in', 'check in', 'checkin', 'چیک ان']
-        
-        if any(x in punch_state_display for x in out_indicators):
-            frappe.logger().info(f"✅ Using punch_state_display (OUT): {punch_state_display}")
-            return "OUT"
-        elif any(x in punch_state_display for x in in_indicators):
-            frappe.logger().info(f"✅ Using punch_state_display (IN): {punch_state_display}")
-            return "IN"
+            log.warning("Error processing field '%s': %s", field, e)
     
-    # Check for any field that might contain 'punch' or 'state'
-    frappe.logger().info("Checking all fields for punch/state indicators...")
+    display = transaction.get('punch_state_display')
+    if display:
+        log_type = _DISPLAY_LOG_TYPES.get(str(display).strip().casefold())
+        if log_type:
+            if is_debug:
+                log.debug("Using punch_state_display: %s -> %s", display, log_type)
+            return log_type
+
+    # Then one pass over every field (punch_state_display included) for an
+    # IN/OUT indicator, OUT first since it is the more specific match
     for key, value in transaction.items():
         if not value and value not in [0, False]:
             continue
             
-        key_lower = key.lower()
-        if 'punch' in key_lower or 'state' in key_lower or 'type' in key_lower:
-            value_str = str(value).lower()
-            out_indicators = ['out', 'check out', 'checkout', 'چیک آؤٹ']
-            in_indicators = ['in', 'check in', 'checkin', 'چیک ان']
+        value_str = str(value).casefold()
+        
+        if _OUT_RE.search(value_str):
+            if is_debug:
+                log.debug("Found OUT indicator in field '%s': %s", key, value)
+            return "OUT"
             
-            if any(x in value_str for x in out_indicators):
-                frappe.logger().info(f"✅ Using field '{key}' (OUT): {value}")
-                return "OUT"
-            elif any(x in value_str for x in in_indicators):
-                frappe.logger().info(f"✅ Using field '{key}' (IN): {value}")
-                return "IN"
-            else:
-                frappe.logger().debug(f"Field '{key}' with value '{value}' didn't match any indicators")
-    
-    # Log all keys for debugging
-    frappe.logger().info("All transaction keys and values:")
-    for key, value in transaction.items():
-        frappe.logger().info(f"  {key}: {value} (type: {type(value).__name__})")
+        if _IN_RE.search(value_str):
+            if is_debug:
+                log.debug("Found IN indicator in field '%s': %s", key, value)
+            return "IN"
     
     # Default to IN if we can't determine (more common to have check-ins than check-outs)
-    frappe.logger().warning("❌ Could not determine log type for transaction, defaulting to IN")
-    frappe.logger().info("===== DETECT_LOG_TYPE END =====")
+    log.warning("Could not determine log type for transaction %s, defaulting to IN (keys: %s)", transaction.get('id'), list(transaction))
     return "IN"
 
 
@@ -179,24 +345,48 @@ def check_device_status(server_ip=None, server_port=None):
     Simple socket connection check to device
     Returns device status without needing token
     """
-    server_ip = server_ip or frappe.db.get_single_value("ZKTeco Config", "server_ip")
-    server_port = server_port or frappe.db.get_single_value("ZKTeco Config", "server_port")
+    if not server_ip or not server_port:
+        cfg = frappe.get_cached_doc("ZKTeco Config")
+        server_ip = server_ip or cfg.server_ip
+        server_port = server_port or cfg.server_port
     
     if not server_ip or not server_port:
         return {"connected": False, "error": "Server IP or Port not configured"}
     
+    # The form polls this; answer repeated checks of the same device from the last probe
+    cache_key = (server_ip, str(server_port))
+    checked_at, status = _DEVICE_STATUS_CACHE.get(cache_key, (None, None))
+    if status is not None and time.monotonic() - checked_at < DEVICE_STATUS_TTL:
+        return status
+
+    status = probe_device(server_ip, server_port)
+    now = time.monotonic()
+    for key, (checked_at, _status) in list(_DEVICE_STATUS_CACHE.items()):
+        if now - checked_at >= DEVICE_STATUS_TTL:
+            _DEVICE_STATUS_CACHE.pop(key, None)
+    if len(_DEVICE_STATUS_CACHE) >= DEVICE_STATUS_CACHE_SIZE:
+        _DEVICE_STATUS_CACHE.clear()
+    _DEVICE_STATUS_CACHE[cache_key] = (now, status)
+    return status
+
+
+def probe_device(server_ip, server_port):
+    """
+    Open and close a TCP connection to the device, timing how long it takes.
+    The connect is non-blocking and waited on with select, so the timeout
+    bounds only the handshake and the time measured is the handshake itself
+    """
     try:
-        import socket
-        import time
-        
-        start_time = time.time()
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(5)
-        
-        result = s.connect_ex((server_ip, int(server_port)))
-        response_time = (time.time() - start_time) * 1000  # Convert to ms
-        s.close()
-        
+        start_time = time.monotonic()
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setblocking(False)
+            result = s.connect_ex((server_ip, int(server_port)))
+            if result in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                _readable, writable, _errored = select.select([], [s], [], DEVICE_PROBE_TIMEOUT)
+                # Writable means the handshake finished; SO_ERROR says how
+                result = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) if writable else errno.ETIMEDOUT
+            response_time = (time.monotonic() - start_time) * 1000  # Convert to ms
+
         if result == 0:
             return {
                 "connected": True,
@@ -247,7 +437,7 @@ def register_api_token(server_ip: str | None = None, server_port: str | int | No
     }
 
     try:
-        resp = requests.post(url, json=payload, timeout=15)
+        resp = _SESSION.post(url, json=payload, timeout=15)
         resp.raise_for_status()
 
         data = resp.json()
@@ -267,10 +457,10 @@ def test_connection():
     Enhanced test connection that shows latest transactions with detailed info
     """
     # Get token from the singleton config
-    cfg = frappe.get_single("ZKTeco Config")
+    cfg = frappe.get_cached_doc("ZKTeco Config")
     token = (cfg.token or "").strip()
-    server_ip = frappe.db.get_single_value("ZKTeco Config", "server_ip")
-    server_port = frappe.db.get_single_value("ZKTeco Config", "server_port")
+    server_ip = cfg.server_ip
+    server_port = cfg.server_port
     
     if str(server_port).strip() == "4370":
         try:
@@ -306,11 +496,11 @@ def test_connection():
     }
 
     try:
-        resp = requests.get(base_url, headers=headers, params=params, timeout=15)
+        resp = _SESSION.get(base_url, headers=headers, params=params, timeout=15)
         
         if resp.ok:
             try:
-                data = resp.json()
+                data = _json_loads(resp.content)
                 
                 # Process and format transaction data for display
                 formatted_transactions = []
@@ -329,8 +519,23 @@ def test_connection():
                 else:
                     transactions = []
                 
+                # Resolve the preview's employee codes with one query, by employee id or user id
+                preview = transactions[:5]
+                emp_codes = tuple({str(t.get('emp_code')) for t in preview if t.get('emp_code')})
+                by_code = {}
+                by_user = {}
+                if emp_codes:
+                    for row in frappe.db.sql(
+                        """SELECT name, employee_name, employee, user_id FROM `tabEmployee`
+                            WHERE employee IN %(codes)s OR user_id IN %(codes)s""",
+                        {"codes": emp_codes},
+                        as_dict=True
+                    ):
+                        by_code.setdefault(row.employee, row)
+                        by_user.setdefault(row.user_id, row)
+
                 # Format latest 5 transactions for preview
-                for transaction in transactions[:5]:
+                for transaction in preview:
                     try:
                         # Map ZKTeco transaction fields based on actual API response
                         emp_code = transaction.get('emp_code')
@@ -350,16 +555,10 @@ def test_connection():
                         erpnext_employee = None
                         if emp_code:
                             # Try to find employee by employee_id or user_id
-                            employee = frappe.db.get_value("Employee", 
-                                                         {"employee": emp_code}, 
-                                                         ["name", "employee_name"])
-                            if not employee:
-                                employee = frappe.db.get_value("Employee", 
-                                                             {"user_id": emp_code}, 
-                                                             ["name", "employee_name"])
+                            employee = by_code.get(str(emp_code)) or by_user.get(str(emp_code))
                             if employee:
-                                erpnext_employee = employee[0] if isinstance(employee, tuple) else employee
-                                employee_name = f"{employee[1]} (ERPNext)" if isinstance(employee, tuple) else f"{employee} (ERPNext)"
+                                erpnext_employee = employee.name
+                                employee_name = f"{employee.employee_name} (ERPNext)"
                         
                         # Determine log type based on punch_state
                         log_type = detect_log_type(transaction)
@@ -414,22 +613,57 @@ def test_connection():
         }
 
 
+def record_sync_totals(sync_time, count):
+    """
+    Set the config's last_sync and add count to total_synced_records in one
+    UPDATE on tabSingles. The counter is incremented in place, so concurrent
+    syncs don't overwrite each other's counts. The caller commits and clears
+    the cached config.
+
+    The UPDATE can't create a missing tabSingles row, so when it touches fewer
+    than both, missing fields are written with set_single_value, which inserts
+    them. Without that a config never saved with last_sync would sync the
+    "last hour" window forever
+    """
+    frappe.db.sql(
+        """UPDATE `tabSingles`
+            SET value = CASE field
+                WHEN 'last_sync' THEN %s
+                ELSE CAST(COALESCE(value, 0) AS SIGNED) + %s
+            END
+            WHERE doctype = 'ZKTeco Config' AND field IN ('last_sync', 'total_synced_records')""",
+        (str(sync_time), count)
+    )
+    if frappe.db._cursor.rowcount >= 2:
+        return
+
+    # Fewer rows can also mean a value was unchanged, so check which rows really exist
+    present = set(frappe.db.sql_list(
+        """SELECT field FROM `tabSingles`
+            WHERE doctype = 'ZKTeco Config' AND field IN ('last_sync', 'total_synced_records')"""
+    ))
+    if "last_sync" not in present:
+        frappe.db.set_single_value("ZKTeco Config", "last_sync", sync_time)
+    if "total_synced_records" not in present:
+        frappe.db.set_single_value("ZKTeco Config", "total_synced_records", count)
+
+
 def sync_zkteco_transactions():
     """
     Main function to sync ZKTeco transactions with ERPNext Employee Checkin records
     """
-    # Implement lock mechanism to prevent concurrent execution
+    # Implement lock mechanism to prevent concurrent execution. One atomic
+    # SET NX EX, so two workers can never both take the lock; it expires
+    # after 5 minutes in case a worker dies holding it
     lock_key = "zkteco_sync_lock"
-    if frappe.cache().get_value(lock_key):
+    cache = frappe.cache()
+    if not cache.set(cache.make_key(lock_key), "locked", nx=True, ex=300):
         frappe.logger().info("ZKTeco sync already running, skipping this execution")
         return
 
     try:
-        # Acquire lock with 5 minute timeout
-        frappe.cache().set_value(lock_key, "locked", expires_in_sec=300)
-
         # Check if sync is enabled
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         if str(cfg.server_port).strip() == "4370":
             frappe.logger().info("ZKTeco Sync skipped: Device mode (port 4370) does not support API-based sync.")
             return
@@ -452,27 +686,43 @@ def sync_zkteco_transactions():
 
         transactions = fetch_zkteco_transactions(cfg, last_sync, current_time)
 
-        transactions = adjust_checkin_sequence(transactions)
+        transactions = adjust_checkin_sequence(dedupe_transactions(transactions))
+        existing_set = prefetch_checkins_for_transactions(transactions)
+        bounds = checkin_time_bounds()
 
         processed_count = 0
         error_count = 0
+        skipped = []
 
         if transactions:
-            for transaction in transactions:
+            for i, transaction in enumerate(transactions, 1):
+                # Invalid transactions come back as skip reasons; only unexpected
+                # failures such as a lost database connection raise
                 try:
-                    if create_employee_checkin(transaction):
-                        processed_count += 1
-                    else:
+                    ok, checkin_data = build_checkin_data(transaction, existing_set, bounds)
+                    if not ok:
+                        skipped.append(checkin_data)
                         error_count += 1
+                    else:
+                        if checkin_data is not None:
+                            insert_checkin(checkin_data, ignore_if_duplicate=True)
+                            existing_set.add(checkin_key(checkin_data["employee"], checkin_data["time"], checkin_data["log_type"]))
+                        processed_count += 1
+                except frappe.DuplicateEntryError:
+                    processed_count += 1
                 except Exception as e:
+                    # Reported with the skips in one Error Log for the batch
                     error_count += 1
-                    frappe.log_error(f"Error creating checkin for transaction {transaction}: {str(e)}", "ZKTeco Sync Error")
+                    skipped.append(("error", f"{transaction_excerpt(transaction)}: {str(e)}"))
+                if i % BATCH_COMMIT_SIZE == 0:
+                    frappe.db.commit()
+
+        log_skipped_transactions(skipped)
 
         # Always update last sync time, even if no transactions found
-        total_synced = frappe.db.get_single_value("ZKTeco Config", "total_synced_records") or 0
-        frappe.db.set_single_value("ZKTeco Config", "last_sync", current_time)
-        frappe.db.set_single_value("ZKTeco Config", "total_synced_records", total_synced + processed_count)
+        record_sync_totals(current_time, processed_count)
         frappe.db.commit()
+        frappe.clear_document_cache("ZKTeco Config", "ZKTeco Config")
 
         if transactions:
             frappe.logger().info(f"ZKTeco Sync completed: {processed_count} processed, {error_count} errors")
@@ -480,10 +730,56 @@ def sync_zkteco_transactions():
             frappe.logger().info("ZKTeco Sync completed: No new transactions found")
 
     except Exception as e:
+        frappe.db.rollback()
         frappe.log_error(f"ZKTeco sync failed: {str(e)}", "ZKTeco Sync Fatal Error")
     finally:
-        # Always release lock when done
-        frappe.cache().delete_value(lock_key)
+        # Always release lock when done, only reached when this run took it
+        cache.delete_value(lock_key)
+
+
+def parse_transactions_page(data):
+    """
+    Split one transactions API response into its records and the next page URL
+
+    Returns:
+        tuple: (transactions, next_url)
+    """
+    if isinstance(data, list):
+        return data, None
+    if not isinstance(data, dict):
+        return [], None
+
+    # Check for pagination
+    next_url = data.get('next')
+    for key in ('data', 'results', 'transactions'):
+        if key in data:
+            return data[key] or [], next_url
+    return [], next_url
+
+
+def page_urls(first_page, next_url, max_pages):
+    """
+    URLs of every page after the first when the API paginates with a page query
+    parameter, so they can be requested concurrently. Returns None when the
+    'next' URL does not follow that pattern and pages have to be walked in order
+    """
+    count = first_page.get('count') if isinstance(first_page, dict) else None
+    parts = urlsplit(next_url)
+    query = parse_qs(parts.query)
+    if not count or 'page' not in query:
+        return None
+
+    try:
+        page_size = int(query.get('page_size', [0])[0]) or len(parse_transactions_page(first_page)[0])
+        n_pages = min(ceil(int(count) / page_size), max_pages)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+    urls = []
+    for page in range(2, n_pages + 1):
+        query['page'] = [str(page)]
+        urls.append(urlunsplit(parts._replace(query=urlencode(query, doseq=True))))
+    return urls
 
 
 def fetch_zkteco_transactions(cfg, start_time, end_time):
@@ -507,431 +803,583 @@ def fetch_zkteco_transactions(cfg, start_time, end_time):
     }
 
     all_transactions = []
-    current_url = base_url
     max_pages = 100  # Prevent infinite loops
 
+    def get_page(url, params=None):
+        resp = _SESSION.get(url, headers=headers, params=params, timeout=30)
+        resp.raise_for_status()
+        return _json_loads(resp.content)
+
     try:
-        for page_num in range(max_pages):
-            # First page uses params, subsequent pages use full URL from 'next'
-            if page_num == 0:
-                resp = requests.get(current_url, headers=headers, params=params, timeout=30)
-            else:
-                resp = requests.get(current_url, headers=headers, timeout=30)
+        # First page uses params, the rest use the full URL from 'next'
+        data = get_page(base_url, params)
+        transactions, next_url = parse_transactions_page(data)
+        all_transactions.extend(transactions)
+        page_count = 1
+
+        urls = page_urls(data, next_url, max_pages) if next_url else None
+        if urls:
+            # Page numbers are known up front: fetch them concurrently, kept in page order
+            with ThreadPoolExecutor(max_workers=FETCH_PAGE_WORKERS) as executor:
+                for data in executor.map(get_page, urls):
+                    all_transactions.extend(parse_transactions_page(data)[0])
+                    page_count += 1
+        else:
+            while next_url and page_count < max_pages:
+                transactions, next_url = parse_transactions_page(get_page(next_url))
+                all_transactions.extend(transactions)
+                page_count += 1
+
+        if len(all_transactions) > 0:
+            frappe.logger().info(f"ZKTeco fetch completed: {len(all_transactions)} transactions from {page_count} page(s)")
+
+        return all_transactions
 
-            resp.raise_for_status()
-            data = resp.json()
+    except Exception as e:
+        frappe.log_error(f"Failed to fetch ZKTeco transactions: {str(e)}", "ZKTeco API Error")
+        return all_transactions if all_transactions else []
 
-            # Extract transactions from response
-            transactions = []
-            next_url = None
 
-            if isinstance(data, dict):
-                # Check for pagination
-                next_url = data.get('next')
+@lru_cache(maxsize=8192)
+def _parse_datetime_str(value):
+    return get_datetime(value)
 
-                # Extract transactions
-                if 'data' in data:
-                    transactions = data['data']
-                elif 'results' in data:
-                    transactions = data['results']
-                elif 'transactions' in data:
-                    transactions = data['transactions']
-            elif isinstance(data, list):
-                transactions = data
 
-            # Add transactions to the list
-            if transactions:
-                all_transactions.extend(transactions)
+def parse_datetime(value):
+    """
+    get_datetime with string results memoized: the same punch time string is parsed
+    by sequence adjustment, the prefetch and checkin creation, and devices often
+    report identical timestamps for many employees
+    """
+    if isinstance(value, str):
+        return _parse_datetime_str(value)
+    return get_datetime(value)
 
-            # Check if there are more pages
-            if not next_url:
-                break
 
-            current_url = next_url
+def parse_punch_time_str(value):
+    """
+    Parse a punch time string: the format that matched last is tried first,
+    then datetime.fromisoformat, then the rest of _TIME_FORMATS.
+    Returns None if no format matches
+    """
+    global _last_time_format
 
-            # Log pagination progress
-            if page_num > 0:
-                frappe.logger().info(f"ZKTeco pagination: Fetched page {page_num + 1}, total transactions so far: {len(all_transactions)}")
+    if _last_time_format:
+        try:
+            return datetime.strptime(value, _last_time_format)
+        except ValueError:
+            pass
 
-        if len(all_transactions) > 0:
-            frappe.logger().info(f"ZKTeco fetch completed: {len(all_transactions)} transactions from {page_num + 1} page(s)")
+    try:
+        punch_time = datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    else:
+        _last_time_format = None
+        return punch_time
+
+    for fmt in _TIME_FORMATS:
+        if fmt == _last_time_format:
+            continue
+        try:
+            punch_time = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        _last_time_format = fmt
+        return punch_time
 
-        return all_transactions
+    return None
 
-    except Exception as e:
-        frappe.log_error(f"Failed to fetch ZKTeco transactions: {str(e)}", "ZKTeco API Error")
-        return all_transactions if all_transactions else []
+
+def epoch_seconds(dt):
+    """
+    Whole seconds from 1970-01-01 to a naive datetime, without timezone conversion
+    """
+    return int((dt - _EPOCH).total_seconds())
+
+
+def checkin_time_bounds():
+    """
+    Current time and the earliest/latest punch times a sync accepts, computed once per batch.
+    The bounds are epoch_seconds() so each punch is checked with two int comparisons
+
+    Returns:
+        tuple: (current_time, earliest_epoch, latest_epoch)
+    """
+    current_time = now_datetime()
+    return (
+        current_time,
+        epoch_seconds(current_time - timedelta(days=MAX_PAST_DAYS)),
+        epoch_seconds(current_time + FUTURE_TOLERANCE),
+    )
+
+
+def dedupe_transactions(transactions):
+    """
+    Drop repeated (emp_code, punch time, punch) transactions, keeping the first
+    occurrence, so punches returned more than once never reach the database
+    """
+    seen = set()
+    unique = []
+    for t in transactions or []:
+        raw_time = next((t[key] for key in SEQUENCE_TIME_FIELDS if t.get(key)), None)
+        # Keyed on the parsed time, so the same punch reported as
+        # "2025-01-01 09:00:00" and "2025-01-01T09:00:00" is still one punch
+        try:
+            punch_time = parse_datetime(raw_time) if raw_time else None
+        except Exception:
+            punch_time = str(raw_time)
+        key = (get_transaction_emp_code(t), punch_time, t.get('punch', t.get('punch_state')))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(t)
+
+    if transactions and len(unique) < len(transactions):
+        frappe.logger().info(f"Dropped {len(transactions) - len(unique)} duplicate transaction(s)")
+    return unique
+
+
+def parses_as_datetime(value):
+    """
+    Whether parse_datetime accepts a punch time, as adjust_checkin_sequence requires
+    """
+    try:
+        parse_datetime(value)
+    except Exception:
+        return False
+    return True
 
 
 def adjust_checkin_sequence(transactions):
-    from collections import defaultdict
-    
     if not transactions:
         return transactions
 
-    frappe.logger().info("===== ADJUST_CHECKIN_SEQUENCE START =====")
-    frappe.logger().info(f"Processing {len(transactions)} transactions")
-    
-    grouped = defaultdict(list)
+    # A lone punch is always its day's only punch, so it just defaults to IN.
+    # Common for API devices polled every minute, and needs no sorting. It must
+    # pass the same employee and time checks as below; one that doesn't is left
+    # to the general path, which skips it so detect_log_type decides later
+    if len(transactions) == 1:
+        punch = transactions[0]
+        raw_time = next((punch[key] for key in SEQUENCE_TIME_FIELDS if punch.get(key)), None)
+        if (punch.get("emp_code") or punch.get("employee_code")) and raw_time and parses_as_datetime(raw_time):
+            if punch.get('log_type') not in ('IN', 'OUT'):
+                punch["log_type"] = "IN"
+                punch["_sequence_adjusted"] = True
+            return transactions
+
+    log = frappe.logger()
+    is_debug = log.isEnabledFor(logging.DEBUG)
+    adjusted_count = 0
 
     # First, log the initial state of all transactions
-    for idx, t in enumerate(transactions):
-        frappe.logger().info(f"Transaction {idx + 1} initial state - log_type: {t.get('log_type')}, time: {t.get('punch_time') or t.get('punchTime') or t.get('time')}")
+    if is_debug:
+        for idx, t in enumerate(transactions):
+            log.debug("Transaction %s initial state - log_type: %s, time: %s", idx + 1, t.get('log_type'), t.get('punch_time') or t.get('punchTime') or t.get('time'))
 
-    # Group punches per employee per date
+    # Parse every punch time once
+    punches = []
     for t in transactions:
         emp = t.get("emp_code") or t.get("employee_code")
-        raw_time = (
-            t.get('punch_time') or t.get('punchTime') or
-            t.get('punchtime') or t.get('timestamp') or
-            t.get('time')
-        )
+        raw_time = next((t[key] for key in SEQUENCE_TIME_FIELDS if t.get(key)), None)
         if not emp or not raw_time:
             frappe.logger().warning(f"Skipping transaction with missing emp_code or time: {t}")
             continue
 
         try:
-            dt = get_datetime(raw_time)
-            date_key = dt.strftime("%Y-%m-%d")
-            grouped[(emp, date_key)].append((dt, t))
+            punches.append((str(emp), parse_datetime(raw_time), t))
         except Exception as e:
             frappe.logger().warning(f"Error parsing time {raw_time}: {str(e)}")
             continue
 
+    # One stable sort by employee and time, then each employee's day is a
+    # consecutive run. Devices usually return punches in time order, which
+    # the sort takes advantage of
+    punches.sort(key=itemgetter(0, 1))
+
     # Process each employee's daily check-ins
-    for (emp, date), punches in grouped.items():
-        frappe.logger().info(f"\nProcessing employee {emp} on {date} - {len(punches)} punches")
-        
-        # Sort by time
-        punches.sort(key=lambda x: x[0])
+    for (emp, date), group in groupby(punches, key=lambda p: (p[0], p[1].date())):
+        punches_of_day = [(dt, t) for _emp, dt, t in group]
+        if is_debug:
+            log.debug("Processing employee %s on %s - %s punches", emp, date, len(punches_of_day))
         
         # Log the sorted punches
-        for i, (dt, t) in enumerate(punches):
-            frappe.logger().info(f"  Punch {i + 1}: {dt.time()} - Current log_type: {t.get('log_type')}")
+        if is_debug:
+            for i, (dt, t) in enumerate(punches_of_day):
+                log.debug("  Punch %s: %s - Current log_type: %s", i + 1, dt.time(), t.get('log_type'))
 
         # If only one punch, set as IN by default
-        if len(punches) == 1:
-            punch = punches[0][1]
+        if len(punches_of_day) == 1:
+            punch = punches_of_day[0][1]
             if 'log_type' not in punch or punch['log_type'] not in ['IN', 'OUT']:
                 punch["log_type"] = "IN"
                 punch["_sequence_adjusted"] = True
-                frappe.logger().info("  Single punch - Set as IN")
+                adjusted_count += 1
+                if is_debug:
+                    log.debug("  Single punch - Set as IN")
             continue
 
         # First punch = IN (if not already set)
-        first = punches[0][1]
+        first = punches_of_day[0][1]
         if 'log_type' not in first or first['log_type'] not in ['IN', 'OUT']:
             first["log_type"] = "IN"
             first["_sequence_adjusted"] = True
-            frappe.logger().info("  First punch - Set as IN")
+            adjusted_count += 1
+            if is_debug:
+                log.debug("  First punch - Set as IN")
 
         # Last punch = OUT (if not already set)
-        last = punches[-1][1]
+        last = punches_of_day[-1][1]
         if 'log_type' not in last or last['log_type'] not in ['IN', 'OUT']:
             last["log_type"] = "OUT"
             last["_sequence_adjusted"] = True
-            frappe.logger().info("  Last punch - Set as OUT")
+            adjusted_count += 1
+            if is_debug:
+                log.debug("  Last punch - Set as OUT")
 
         # For exactly two punches, we're done
-        if len(punches) == 2:
-            frappe.logger().info("  Two punches - First is IN, Last is OUT")
+        if len(punches_of_day) == 2:
             continue
 
         # For more than two punches, alternate the middle ones
         prev_type = "IN"  # Start with IN for the first punch
-        for i in range(1, len(punches) - 1):
-            current = punches[i][1]
+        for i in range(1, len(punches_of_day) - 1):
+            current = punches_of_day[i][1]
             
             # Skip if already has a valid log type
             if 'log_type' in current and current['log_type'] in ['IN', 'OUT']:
                 prev_type = current['log_type']
-                frappe.logger().info(f"  Middle punch {i} - Using existing log_type: {prev_type}")
                 continue
                 
             # Alternate the log type
             current["log_type"] = "OUT" if prev_type == "IN" else "IN"
             current["_sequence_adjusted"] = True
-            frappe.logger().info(f"  Middle punch {i} - Set as {current['log_type']} (prev: {prev_type})")
+            adjusted_count += 1
+            if is_debug:
+                log.debug("  Middle punch %s - Set as %s (prev: %s)", i, current["log_type"], prev_type)
             prev_type = current["log_type"]
 
-    frappe.logger().info("===== ADJUST_CHECKIN_SEQUENCE END =====")
+    log.info("Sequence adjusted %s of %s transactions", adjusted_count, len(transactions))
     return transactions
 
-    return transactions
 
+def insert_checkin(checkin_data, **insert_kwargs):
+    """
+    Insert an Employee Checkin under a savepoint, so a failing row is undone
+    without discarding the rest of the uncommitted batch
+    """
+    frappe.db.savepoint("zkteco_checkin")
+    try:
+        checkin = frappe.get_doc(checkin_data)
+        checkin.insert(ignore_permissions=True, **insert_kwargs)
+    except Exception:
+        frappe.db.rollback(save_point="zkteco_checkin")
+        raise
+    frappe.db.release_savepoint("zkteco_checkin")
+    return checkin
+
+
+def dump_json(obj):
+    """
+    Compact JSON text of a transaction or checkin for log messages
+    """
+    if orjson:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default=str, ensure_ascii=False)
 
 
-def create_employee_checkin(transaction):
+def transaction_excerpt(transaction):
     """
-    Create Employee Checkin record from ZKTeco transaction
+    Transaction as JSON for Error Log messages, cut to TRANSACTION_EXCERPT_LENGTH characters
     """
-    try:
-        # Log raw transaction for debugging
-        frappe.logger().info(f"Raw transaction data: {json.dumps(transaction, default=str, ensure_ascii=False)}")
-        
-        # Log the incoming transaction for debugging
-        frappe.logger().debug(f"Processing transaction: {json.dumps(transaction, default=str, ensure_ascii=False)}")
-        
-        # Extract transaction data based on ZKTeco API response structure
-        try:
-            # Extract employee code with multiple possible field names
-            emp_code = (
-                transaction.get('emp_code') or 
-                transaction.get('employee_code') or
-                transaction.get('employee_no') or
-                str(transaction.get('id', '')).split('_')[0]  # Fallback for IDs like 'EMP001_123'
-            )
-            
-            # Define all possible time fields to check
-            time_fields = [
-                'punch_time', 'punchTime', 'punchtime', 'time', 
-                'timestamp', 'punchTimeStr', 'checktime', 'record_time'
-            ]
-            
-            # Define all possible datetime formats to try
-            time_formats = [
-                '%Y-%m-%d %H:%M:%S',    # 2023-12-08 14:30:45
-                '%Y-%m-%dT%H:%M:%S',    # 2023-12-08T14:30:45
-                '%Y-%m-%d %H:%M',       # 2023-12-08 14:30
-                '%Y-%m-%d',             # 2023-12-08
-                '%Y/%m/%d %H:%M:%S',    # 2023/12/08 14:30:45
-                '%d-%m-%Y %H:%M:%S',    # 08-12-2023 14:30:45
-                '%d/%m/%Y %H:%M:%S',    # 08/12/2023 14:30:45
-                '%Y%m%d%H%M%S',         # 20231208143045
-                '%Y%m%d',               # 20231208
-                '%d.%m.%Y %H:%M:%S',    # 08.12.2023 14:30:45
-                '%b %d %Y %H:%M:%S',    # Dec 08 2023 14:30:45
-                '%b %d %Y %H:%M:%S.%f', # Dec 08 2023 14:30:45.123456
-                '%Y-%m-%d %H:%M:%S.%f', # 2023-12-08 14:30:45.123456
-                '%Y-%m-%d %H:%M:%S%z',  # 2023-12-08 14:30:45+0500
-                '%Y-%m-%dT%H:%M:%S%z',  # 2023-12-08T14:30:45+0500
-            ]
-            
-            punch_time = None
-            used_field = None
-            
-            # Try each time field
-            for field in time_fields:
-                if field not in transaction or not transaction[field]:
-                    continue
-                    
-                value = transaction[field]
-                used_field = field
-                
-                # Handle None or empty values
-                if value is None or (isinstance(value, str) and not value.strip()):
-                    continue
-                    
-                # Handle string timestamps
-                if isinstance(value, str):
-                    value = value.strip()
-                    for fmt in time_formats:
-                        try:
-                            punch_time = datetime.strptime(value, fmt)
-                            frappe.logger().debug(f"Parsed {field} as {fmt}: {punch_time}")
-                            break
-                        except ValueError:
-                            continue
-                # Handle numeric timestamps (UNIX timestamp in seconds or milliseconds)
-                elif isinstance(value, (int, float)):
-                    try:
-                        ts = float(value)
-                        # If timestamp is in milliseconds, convert to seconds
-                        if ts > 1e12:  # Roughly year 2001 in milliseconds
-                            ts = ts / 1000.0
-                        punch_time = datetime.fromtimestamp(ts)
-                        frappe.logger().debug(f"Converted {field} from timestamp: {punch_time}")
-                    except (ValueError, TypeError, OSError) as e:
-                        frappe.logger().debug(f"Failed to parse timestamp {value} from {field}: {str(e)}")
-                        continue
-                # Handle datetime objects directly
-                elif hasattr(value, 'strftime'):  # Already a datetime object
-                    punch_time = value
-                    frappe.logger().debug(f"Using direct datetime object from {field}: {punch_time}")
-                    break
-                
-                if punch_time is not None:
-                    break
-            
-            if punch_time is None:
-                frappe.logger().warning(f"Could not parse punch time from transaction: {json.dumps(transaction, default=str)}")
-                return False
-                
-            # Log which field was used for debugging
-            if used_field:
-                frappe.logger().debug(f"Using time from field: {used_field} = {punch_time}")
-            
+    text = dump_json(transaction)
+    if len(text) > TRANSACTION_EXCERPT_LENGTH:
+        return text[:TRANSACTION_EXCERPT_LENGTH] + "..."
+    return text
+
+
+def get_transaction_emp_code(transaction):
+    """
+    Extract the employee code from a transaction, trying every field name the API is known to use
+    """
+    return (
+        next((transaction[field] for field in EMP_CODE_FIELDS if transaction.get(field)), None) or
+        str(transaction.get('id', '')).split('_', 1)[0]  # Fallback for IDs like 'EMP001_123'
+    )
+
+
+def checkin_key(employee, time, log_type):
+    """
+    Key identifying a checkin in the set returned by prefetch_existing_checkins.
+    Time is whole seconds since 1970-01-01 taken on the naive value, matching
+    TIMESTAMPDIFF(SECOND, '1970-01-01', time) on the database side without any
+    timezone conversion
+    """
+    return (employee, epoch_seconds(parse_datetime(time)), log_type)
+
+
+def prefetch_existing_checkins(employees, t_min, t_max):
+    """
+    Load existing checkins of the given employees between t_min and t_max in one query.
+    Served by the idx_zkt_checkin_dedup index on (employee, time, log_type)
+
+    Returns:
+        set: checkin_key() tuples of (employee, epoch seconds, log_type)
+    """
+    if not employees or not t_min or not t_max:
+        return set()
+
+    rows = frappe.db.sql(
+        """SELECT employee, TIMESTAMPDIFF(SECOND, '1970-01-01', time), log_type FROM `tabEmployee Checkin`
+            WHERE time BETWEEN %(t_min)s AND %(t_max)s
+            AND employee IN %(employees)s""",
+        {
+            "t_min": t_min,
+            "t_max": t_max,
+            "employees": tuple(employees),
+        }
+    )
+    return {(employee, int(epoch), log_type) for employee, epoch, log_type in rows}
+
+
+def prefetch_checkins_for_transactions(transactions):
+    """
+    Prefetch existing checkins covering every employee and the punch time range of a batch
+    """
+    emp_codes = {get_transaction_emp_code(t) for t in transactions or []}
+    emp_codes.discard(None)
+    emp_codes.discard("")
+    employee_map = warm_employee_cache(emp_codes)
+    employees = {employee for employee in employee_map.values() if employee}
+    t_min = t_max = None
+
+    for t in transactions or []:
+        # Same fields and parser as the checkin that will be created
+        dt, _field = get_transaction_punch_time(t)
+        if dt:
+            dt = dt.replace(microsecond=0)
+            t_min = dt if t_min is None or dt < t_min else t_min
+            t_max = dt if t_max is None or dt > t_max else t_max
+
+    return prefetch_existing_checkins(employees, t_min, t_max)
+
+
+def get_transaction_punch_time(transaction):
+    """
+    Punch time of a transaction from the first usable CHECKIN_TIME_FIELDS value:
+    strings through parse_punch_time_str, numbers as UNIX seconds or milliseconds,
+    datetimes as is. Shared by checkin creation and the duplicate prefetch, so
+    both see the same time for a transaction
+
+    Returns:
+        tuple: (naive datetime, field used), or (None, None) when no field parses
+    """
+    for field in CHECKIN_TIME_FIELDS:
+        value = transaction.get(field)
+
+        # Handle None or empty values
+        if not value or (isinstance(value, str) and not value.strip()):
+            continue
+
+        punch_time = None
+        # Handle string timestamps
+        if isinstance(value, str):
+            punch_time = parse_punch_time_str(value.strip())
+        # Handle numeric timestamps (UNIX timestamp in seconds or milliseconds)
+        elif isinstance(value, (int, float)):
+            ts = float(value)
+            # If timestamp is in milliseconds, convert to seconds
+            if ts > 1e12:  # Roughly year 2001 in milliseconds
+                ts = ts / 1000.0
+            try:
+                punch_time = datetime.fromtimestamp(ts)
+            except (ValueError, OverflowError, OSError):
+                continue
+        # Handle datetime objects directly
+        elif isinstance(value, datetime):
+            punch_time = value
+
+        if punch_time is not None:
             # Ensure punch_time is timezone-naive (remove timezone info if present)
-            if hasattr(punch_time, 'tzinfo') and punch_time.tzinfo is not None:
-                punch_time = punch_time.replace(tzinfo=None)
-            
-            # Get device information
-            device_id = (
-                transaction.get('terminal_alias') or 
-                transaction.get('terminal_sn') or 
-                transaction.get('device_alias') or
-                transaction.get('device_id') or
-                f"{transaction.get('ip_address', '')}:{transaction.get('port', '')}" or
-                'Unknown'
-            )
-            
-            transaction_id = transaction.get('id') or transaction.get('transaction_id') or transaction.get('uid') or 'unknown'
-            
-            # Additional logging for debugging
-            frappe.logger().debug(f"Extracted data - Emp: {emp_code}, Time: {punch_time} (type: {type(punch_time)}), Device: {device_id}, ID: {transaction_id}")
-            
-            if not emp_code:
-                frappe.logger().warning(f"Missing employee code in transaction: {json.dumps(transaction, default=str)}")
-                return False
-                
-            # Validate punch time is within a reasonable range
-            now = now_datetime()
-            if not isinstance(punch_time, datetime):
-                frappe.logger().warning(f"Invalid punch_time type: {type(punch_time)} for transaction {transaction_id}")
-                return False
-                
-            if punch_time > now + timedelta(days=1):  # Future date check (allow 1 day in future for timezone differences)
-                frappe.logger().warning(f"Future date in transaction {transaction_id}: {punch_time} (current time: {now})")
-                return False
-                
-            if (now - punch_time) > timedelta(days=90):
-                frappe.logger().warning(f"Skipping old transaction: {transaction_id} from {punch_time}")
-                return False
-                
-        except Exception as e:
-            frappe.log_error(f"Error processing transaction data: {str(e)}\nTransaction: {json.dumps(transaction, default=str)}", "ZKTeco Data Processing Error")
-            return False
-        
-        # Find employee
-        employee = find_employee_by_code(emp_code)
-        if not employee:
-            frappe.log_error(f"Employee not found for code: {emp_code}", "ZKTeco Employee Mapping")
-            return False
-        
-        # Convert punch_time to datetime
-        try:
-            if isinstance(punch_time, str):
-                punch_datetime = get_datetime(punch_time)
-            else:
-                punch_datetime = punch_time
-                
-            # If we still don't have a valid datetime, try parsing from timestamp
-            if not punch_datetime and 'timestamp' in transaction:
-                try:
-                    punch_datetime = get_datetime(transaction['timestamp']/1000)  # Convert from milliseconds
-                except:
-                    pass
-                    
-            if not punch_datetime:
-                frappe.log_error(f"Could not parse punch time: {punch_time}", "ZKTeco Time Parse Error")
-                return False
-                
-        except Exception as e:
-            frappe.log_error(f"Error parsing time {punch_time}: {str(e)}", "ZKTeco Time Parse Error")
-            return False
+            return punch_time.replace(tzinfo=None), field
 
-        # Validate timestamp is reasonable
-        current_time = now_datetime()
-        max_past_days = 90  # Don't sync records older than 90 days
+    return None, None
 
-        # Check if timestamp is in the future (with 5-minute buffer for clock differences)
-        if punch_datetime > current_time + timedelta(minutes=5):
-            frappe.log_error(
-                f"Transaction timestamp is in the future: {punch_datetime} (current: {current_time})\nTransaction: {json.dumps(transaction, default=str, ensure_ascii=False)}",
-                "ZKTeco Invalid Timestamp"
-            )
-            return False
 
-        # Check if timestamp is too old
-        if punch_datetime < current_time - timedelta(days=max_past_days):
-            frappe.logger().debug(
-                f"Skipping old transaction: {punch_datetime} (older than {max_past_days} days)"
-            )
-            return False
+def build_checkin_data(transaction, existing_set=None, bounds=None):
+    """
+    Validate a ZKTeco transaction and build its Employee Checkin without writing anything.
+    Skips are returned rather than raised, so the normal flow never builds an exception
 
-        # Check if log_type was already set by adjust_checkin_sequence
-        if transaction.get('_sequence_adjusted') is not None and transaction.get('log_type'):
-            log_type = transaction['log_type']
-            frappe.logger().info(f"Using sequence-adjusted log type: {log_type}")
-        else:
-            # Log before detecting log type
-            frappe.logger().info("Detecting log type for transaction")
-            log_type = detect_log_type(transaction)
-            
-            # Log the detected log type
-            if log_type:
-                frappe.logger().info(f"Detected log type: {log_type}")
-            else:
-                log_type = "IN"  # Default to "IN" if detection fails
-                frappe.logger().warning("Could not determine log type, defaulting to IN")
-                
-            # Log the final log type being used
-            frappe.logger().info(f"Final log type being used: {log_type}")
-            
-            # Also log transaction keys for debugging
-            frappe.logger().info(f"Transaction keys: {list(transaction.keys())}")
-            if 'punch_state_display' in transaction:
-                frappe.logger().info(f"punch_state_display: {transaction['punch_state_display']}")
-            if 'punch_state' in transaction:
-                frappe.logger().info(f"punch_state: {transaction['punch_state']}")
-            if 'punch' in transaction:
-                frappe.logger().info(f"punch: {transaction['punch']}")
-
-        # Build unique device_id with transaction ID to prevent duplicates
-        unique_device_id = f"{device_id} (ZKTeco-{transaction_id})" if (device_id and transaction_id) else (device_id or f"ZKTeco-{transaction_id}" if transaction_id else "ZKTeco Device")
-        
-        # Clean up device ID if it's too long (Frappe has a limit of 140 chars)
-        unique_device_id = (unique_device_id[:135] + '...') if len(unique_device_id) > 140 else unique_device_id
+    Args:
+        transaction: Transaction dict from the ZKTeco API
+        existing_set: Optional set from prefetch_existing_checkins, checked instead of querying for duplicates
+        bounds: Optional checkin_time_bounds() shared by the whole batch
 
-        # Create a more precise timestamp for the checkin (including seconds)
-        checkin_time = punch_datetime.strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Check if checkin already exists - include log_type to allow both IN and OUT for same employee/time
-        existing_checkin = frappe.db.get_value("Employee Checkin", {
-            "employee": employee,
-            "time": ["=", checkin_time],
-            "log_type": log_type,
-            "device_id": ["like", f"%{device_id}%" if device_id else "%ZKTeco%"]
-        }, ['name', 'device_id', 'log_type'], as_dict=1)
+    Returns:
+        tuple: (True, checkin_data) for a new checkin, (True, None) when it already
+        exists, or (False, (reason, detail)) when the transaction is skipped
+    """
+    current_time, earliest, latest = bounds or checkin_time_bounds()
+    # Called once per transaction: only build debug messages when they will be emitted
+    log = frappe.logger()
+    is_debug = log.isEnabledFor(logging.DEBUG)
 
-        if existing_checkin:
-            frappe.logger().debug(f"Skipping duplicate checkin: {employee} at {checkin_time} ({log_type}) - {existing_checkin}")
-            return True  # Already processed
-        
-        # Create Employee Checkin
-        checkin_data = {
-            "doctype": "Employee Checkin",
+    # Log the incoming transaction for debugging
+    if is_debug:
+        log.debug("Processing transaction: %s", dump_json(transaction))
+
+    # Extract employee code with multiple possible field names
+    emp_code = get_transaction_emp_code(transaction)
+
+    punch_time, used_field = get_transaction_punch_time(transaction)
+
+    if punch_time is None:
+        return False, ("no_time", f"Could not parse punch time from transaction {transaction.get('id')} (keys: {list(transaction)})")
+
+    # Log which field was used for debugging
+    if is_debug:
+        log.debug("Using time from field: %s = %s", used_field, punch_time)
+
+    # Get device information
+    device_id = (
+        next((transaction[field] for field in DEVICE_ID_FIELDS if transaction.get(field)), None) or
+        f"{transaction.get('ip_address', '')}:{transaction.get('port', '')}"
+    )
+
+    transaction_id = next((transaction[field] for field in TRANSACTION_ID_FIELDS if transaction.get(field)), 'unknown')
+
+    # Additional logging for debugging
+    if is_debug:
+        log.debug("Extracted data - Emp: %s, Time: %s, Device: %s, ID: %s", emp_code, punch_time, device_id, transaction_id)
+
+    if not emp_code:
+        return False, ("no_employee_code", f"Missing employee code in transaction {transaction_id}")
+
+    # Check if timestamp is in the future (with FUTURE_TOLERANCE for clock differences)
+    punch_epoch = epoch_seconds(punch_time)
+    if punch_epoch > latest:
+        return False, ("future", f"Transaction timestamp is in the future: {punch_time} (current: {current_time})\nTransaction: {transaction_excerpt(transaction)}")
+
+    if punch_epoch < earliest:
+        return False, ("too_old", f"Skipping old transaction: {transaction_id} from {punch_time}")
+
+    # Find employee
+    employee = find_employee_by_code(emp_code)
+    if not employee:
+        return False, ("unknown_employee", f"Employee not found for code: {emp_code}")
+
+    # Check if log_type was already set by adjust_checkin_sequence
+    if transaction.get('_sequence_adjusted') is not None and transaction.get('log_type'):
+        log_type = transaction['log_type']
+    else:
+        # detect_log_type falls back to IN when nothing matches
+        log_type = detect_log_type(transaction)
+
+    if is_debug:
+        log.debug("Log type: %s", log_type)
+
+    # Build unique device_id with transaction ID to prevent duplicates
+    unique_device_id = f"{device_id} (ZKTeco-{transaction_id})" if (device_id and transaction_id) else (device_id or f"ZKTeco-{transaction_id}" if transaction_id else "ZKTeco Device")
+
+    # Clean up device ID if it's too long (Frappe has a limit of 140 chars)
+    unique_device_id = (unique_device_id[:135] + '...') if len(unique_device_id) > 140 else unique_device_id
+
+    # Checkin time to the second; the datetime goes to the database as is, no string formatting
+    checkin_time = punch_time.replace(microsecond=0)
+
+    # Check if checkin already exists - include log_type to allow both IN and OUT for same employee/time
+    if existing_set is not None:
+        existing_checkin = (employee, punch_epoch, log_type) in existing_set
+    else:
+        existing_checkin = frappe.db.exists("Employee Checkin", {
             "employee": employee,
             "time": checkin_time,
-            "log_type": log_type,
-            "device_id": unique_device_id,
-            "skip_auto_attendance": 0
-        }
-        
-        # Add additional metadata if available
-        for field in ['device_name', 'terminal_sn', 'terminal_alias', 'verify_type', 'verify_type_display']:
-            if field in transaction and transaction[field]:
-                checkin_data[f'zkteco_{field}'] = str(transaction[field])
-        
-        # Log the checkin data for debugging
-        frappe.logger().debug(f"Creating checkin: {json.dumps(checkin_data, default=str)}")
-        
-        checkin = frappe.get_doc(checkin_data)
-        checkin.insert(ignore_permissions=True, ignore_if_duplicate=True)
-        frappe.db.commit()
-        
-        frappe.logger().info(f"Created {log_type} checkin for employee {employee} at {checkin_time}")
+            "log_type": log_type
+        })
+
+    if existing_checkin:
+        if is_debug:
+            log.debug("Skipping duplicate checkin: %s at %s (%s)", employee, checkin_time, log_type)
+        return True, None  # Already processed
+
+    # Create Employee Checkin
+    checkin_data = {
+        "doctype": "Employee Checkin",
+        "employee": employee,
+        "time": checkin_time,
+        "log_type": log_type,
+        "device_id": unique_device_id,
+        "skip_auto_attendance": 0,
+        "source": CHECKIN_SOURCE
+    }
+
+    # Add additional metadata if available
+    for field in ('device_name', 'terminal_sn', 'terminal_alias', 'verify_type', 'verify_type_display'):
+        if transaction.get(field):
+            checkin_data[f'zkteco_{field}'] = str(transaction[field])
+
+    return True, checkin_data
+
+
+def log_skipped_transactions(skipped):
+    """
+    Report (reason, detail) skips from build_checkin_data: one log line with the
+    counts per reason, and one Error Log per reason that needs attention
+    """
+    if not skipped:
+        return
+
+    by_reason = {}
+    for reason, detail in skipped:
+        by_reason.setdefault(reason, []).append(detail)
+
+    log = frappe.logger()
+    log.warning(
+        "ZKTeco skipped %s transaction(s): %s",
+        len(skipped), ", ".join(f"{reason}={len(details)}" for reason, details in by_reason.items())
+    )
+    if log.isEnabledFor(logging.DEBUG):
+        for reason, details in by_reason.items():
+            if reason not in SKIP_ERROR_TITLES:
+                log.debug("Skipped (%s): %s", reason, "; ".join(details))
+
+    for reason, title in SKIP_ERROR_TITLES.items():
+        details = by_reason.get(reason)
+        if not details:
+            continue
+        message = "\n".join(dict.fromkeys(details[:SKIP_ERROR_DETAILS]))
+        if len(details) > SKIP_ERROR_DETAILS:
+            message += f"\n... and {len(details) - SKIP_ERROR_DETAILS} more"
+        frappe.log_error(message, title)
+
+
+def create_employee_checkin(transaction, existing_set=None, bounds=None):
+    """
+    Create Employee Checkin record from ZKTeco transaction
+
+    Args:
+        transaction: Transaction dict from the ZKTeco API
+        existing_set: Optional set from prefetch_existing_checkins, checked instead of querying for duplicates
+        bounds: Optional checkin_time_bounds() shared by the whole batch
+    """
+    try:
+        ok, result = build_checkin_data(transaction, existing_set, bounds)
+        if not ok:
+            log_skipped_transactions([result])
+            return False
+        if result is not None:
+            insert_checkin(result, ignore_if_duplicate=True)
+            if existing_set is not None:
+                existing_set.add(checkin_key(result["employee"], result["time"], result["log_type"]))
         return True
-        
-    except frappe.DuplicateEntryError:
-        frappe.logger().debug(f"Duplicate checkin detected and skipped: {str(e)}")
-        frappe.db.rollback()
+
+    except frappe.DuplicateEntryError as e:
+        frappe.logger().debug("Duplicate checkin detected and skipped: %s", e)
         return True
     except Exception as e:
-        error_msg = f"Error creating Employee Checkin: {str(e)}\nTransaction: {json.dumps(transaction, default=str, ensure_ascii=False)}"
+        error_msg = f"Error creating Employee Checkin: {str(e)}\nTransaction: {transaction_excerpt(transaction)}"
         frappe.log_error(error_msg, "ZKTeco Checkin Creation Error")
-        frappe.db.rollback()
-        return False
         return False
 
 
@@ -1005,10 +1453,79 @@ def test_transaction_parsing(transaction_json):
         }
 
 
+@cache
+def has_attendance_device_id(site):
+    """
+    Whether Employee has the attendance_device_id column, probed once per site per process
+    """
+    return frappe.db.has_column("Employee", "attendance_device_id")
+
+
+def employee_code_key(code):
+    """
+    Key for matching a device's employee code against Employee fields the way
+    the database's case-insensitive collation does, ignoring surrounding spaces
+    """
+    return str(code).strip().casefold()
+
+
+def warm_employee_cache(emp_codes):
+    """
+    Resolve a batch of employee codes with one query and load the results into
+    the cache used by find_employee_by_code. Codes matching nothing are cached as None.
+
+    Returns:
+        dict: emp_code -> Employee name or None
+    """
+    _EMPLOYEE_CACHE.clear()
+    codes = tuple({str(code) for code in emp_codes})
+    if not codes:
+        return {}
+
+    # Same priority as find_employee_by_code: employee, then user_id, then attendance_device_id
+    fields = ["employee", "user_id"]
+    if has_attendance_device_id(frappe.local.site):
+        fields.append("attendance_device_id")
+
+    rows = frappe.db.sql(
+        "SELECT name, {fields} FROM `tabEmployee` WHERE {conditions}".format(
+            fields=", ".join(f"`{field}`" for field in fields),
+            conditions=" OR ".join(f"`{field}` IN %(codes)s" for field in fields)
+        ),
+        {"codes": codes},
+        as_dict=True
+    )
+
+    # The IN match above is case-insensitive, so rows are mapped back to the
+    # device's codes by normalized key; an exact comparison would cache None
+    # for codes whose case differs and hide them from the per-field fallback
+    codes_by_key = {}
+    for code in codes:
+        codes_by_key.setdefault(employee_code_key(code), []).append(code)
+
+    employee_map = dict.fromkeys(codes)
+    for field in reversed(fields):
+        for row in rows:
+            value = row.get(field)
+            if value is None:
+                continue
+            for code in codes_by_key.get(employee_code_key(value), ()):
+                employee_map[code] = row.name
+
+    site = frappe.local.site
+    for code, employee in employee_map.items():
+        _EMPLOYEE_CACHE[(site, code)] = employee
+    return employee_map
+
+
 def find_employee_by_code(emp_code):
     """
-    Find employee by various ID fields
+    Find employee by various ID fields, served from the batch cache when warmed
     """
+    cache_key = (frappe.local.site, str(emp_code))
+    if cache_key in _EMPLOYEE_CACHE:
+        return _EMPLOYEE_CACHE[cache_key]
+
     # Try employee field first
     employee = frappe.db.get_value("Employee", {"employee": emp_code}, "name")
     if employee:
@@ -1020,7 +1537,7 @@ def find_employee_by_code(emp_code):
         return employee
     
     # Try attendance_device_id if it exists
-    if frappe.db.has_column("Employee", "attendance_device_id"):
+    if has_attendance_device_id(frappe.local.site):
         employee = frappe.db.get_value("Employee", {"attendance_device_id": emp_code}, "name")
         if employee:
             return employee
@@ -1086,7 +1603,7 @@ def manual_sync():
     Manual sync trigger for testing
     """
     try:
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         if str(cfg.server_port).strip() == "4370":
             return device_mode_sync()
         sync_zkteco_transactions()
@@ -1101,23 +1618,18 @@ def scheduled_sync():
     Scheduled sync function that respects the frequency setting
     """
     try:
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         if not cfg.enable_sync:
             return
 
         # For frequent syncs (less than 60 seconds), check if we should actually run
         sync_seconds = int(cfg.seconds or 300)
         if sync_seconds < 60:
-            last_run = frappe.cache().get_value("zkteco_last_sync_run")
-            current_time = now_datetime()
-
-            if last_run:
-                time_diff = (current_time - get_datetime(last_run)).total_seconds()
-                if time_diff < sync_seconds:
-                    return  # Not yet time for next sync
-
-            # Update last run time
-            frappe.cache().set_value("zkteco_last_sync_run", current_time)
+            # One atomic SET NX EX: the key only exists for sync_seconds after the last run,
+            # so failing to set it means it is not yet time for the next sync
+            cache = frappe.cache()
+            if not cache.set(cache.make_key("zkteco_last_sync_run"), str(now_datetime()), nx=True, ex=sync_seconds):
+                return
 
         # Check if using multiple devices
         if cfg.use_multiple_devices and cfg.devices:
@@ -1136,7 +1648,7 @@ def cleanup_scheduler_check():
     Cleanup function to ensure scheduler is working properly
     """
     try:
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         if cfg.enable_sync:
             # Log that the scheduler is active
             frappe.logger().info("ZKTeco scheduler check: Active")
@@ -1150,29 +1662,20 @@ def get_sync_status():
     Get current sync status and statistics
     """
     try:
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         
         # Get last sync time
         last_sync = frappe.db.get_single_value("ZKTeco Config", "last_sync")
         
-        # Count recent employee checkins from ZKTeco
-        recent_checkins = frappe.db.count("Employee Checkin", {
-            "device_id": ["like", "%ZKTeco%"],
-            "creation": [">=", frappe.utils.add_days(today(), -1)]
-        })
-        
-        # Count IN and OUT separately
-        checkins_in = frappe.db.count("Employee Checkin", {
-            "device_id": ["like", "%ZKTeco%"],
-            "log_type": "IN",
-            "creation": [">=", frappe.utils.add_days(today(), -1)]
-        })
-        
-        checkins_out = frappe.db.count("Employee Checkin", {
-            "device_id": ["like", "%ZKTeco%"],
-            "log_type": "OUT",
-            "creation": [">=", frappe.utils.add_days(today(), -1)]
-        })
+        # Count recent employee checkins from ZKTeco per log type in one indexed scan
+        counts = dict(frappe.db.sql("""
+            SELECT log_type, COUNT(*) FROM `tabEmployee Checkin`
+            WHERE source = %(source)s AND creation >= %(since)s
+            GROUP BY log_type
+        """, {"source": CHECKIN_SOURCE, "since": frappe.utils.add_days(today(), -1)}))
+        recent_checkins = sum(counts.values())
+        checkins_in = counts.get("IN", 0)
+        checkins_out = counts.get("OUT", 0)
         
         return {
             "enabled": cfg.enable_sync,
@@ -1208,6 +1711,87 @@ def set_config(server_ip: str, server_port: str | int, enable_sync: int = 1, sec
     }
 
 
+@cache
+def get_zk():
+    """
+    The pyzk ZK class, imported on first use so workers that only run API
+    syncs never load it. None if the library is not installed
+    """
+    try:
+        from zk import ZK
+    except Exception:
+        return None
+    return ZK
+
+
+def device_lock(ip, port):
+    """
+    Lock serializing use of one device's pooled connection
+    """
+    with _ZK_LOCK:
+        return _ZK_LOCKS.setdefault((ip, port), threading.Lock())
+
+
+def get_device_connection(ip, port):
+    """
+    Return the pooled connection to a device, dialing a new one if there is none or it was closed
+    """
+    conn = _ZK_CONNECTIONS.get((ip, port))
+    if conn is None or not conn.is_connect:
+        conn = get_zk()(ip, port=port, timeout=DEVICE_TIMEOUT, ommit_ping=True).connect()
+        _ZK_CONNECTIONS[(ip, port)] = conn
+    return conn
+
+
+def drop_device_connection(ip, port):
+    """
+    Forget the pooled connection to a device, closing it if possible
+    """
+    conn = _ZK_CONNECTIONS.pop((ip, port), None)
+    if conn is not None:
+        try:
+            conn.disconnect()
+        except Exception:
+            pass
+
+
+def read_device_attendance(ip, port):
+    """
+    Read attendance records over the pooled device connection. A connection that
+    went stale between syncs is dropped and redialed once before giving up
+    """
+    with device_lock(ip, port):
+        for attempt in range(2):
+            try:
+                return get_device_connection(ip, port).get_attendance()
+            except Exception:
+                drop_device_connection(ip, port)
+                if attempt:
+                    raise
+
+
+def attendance_to_transactions(records, bounds):
+    """
+    Convert device attendance records to transaction dicts. A device returns
+    its whole history, so records from days that end before the earliest
+    accepted punch are dropped here instead of being carried through the sync.
+    Whole days are kept so sequence adjustment still sees every punch of a day.
+    pyzk's Attendance always sets user_id (str), timestamp (datetime) and punch (int)
+    """
+    first_day = (_EPOCH + timedelta(seconds=bounds[1])).replace(hour=0, minute=0, second=0, microsecond=0)
+    return [
+        {
+            "emp_code": att.user_id,
+            "punch_time": att.timestamp,
+            "punch": att.punch,
+            "timestamp": att.timestamp,
+            "_device_mode": True
+        }
+        for att in records or ()
+        if att.user_id and att.timestamp and att.timestamp >= first_day
+    ]
+
+
 @frappe.whitelist()
 def device_mode_sync():
     # Implement lock mechanism to prevent concurrent execution
@@ -1219,54 +1803,43 @@ def device_mode_sync():
         # Acquire lock with 5 minute timeout
         frappe.cache().set_value(lock_key, "locked", expires_in_sec=300)
 
-        cfg = frappe.get_single("ZKTeco Config")
+        cfg = frappe.get_cached_doc("ZKTeco Config")
         ip = cfg.server_ip
         port = int(str(cfg.server_port or "4370").strip())
         if port != 4370:
             return {"success": False, "message": "Device mode only supports port 4370"}
-        if not ZK:
+        if not get_zk():
             return {"success": False, "message": "Device library not available"}
 
-        zk = ZK(ip, port=port, timeout=10, ommit_ping=True)
-        conn = zk.connect()
-        records = conn.get_attendance()
+        records = read_device_attendance(ip, port)
 
         # Convert attendance records to transaction format
-        transactions = []
-        for att in records or []:
-            emp_code = str(getattr(att, "user_id", "") or "").strip()
-            punch_datetime = getattr(att, "timestamp", None)
-            punch_val = int(getattr(att, "punch", 0))
-
-            if emp_code and punch_datetime:
-                transactions.append({
-                    "emp_code": emp_code,
-                    "punch_time": punch_datetime,
-                    "punch": punch_val,
-                    "timestamp": punch_datetime,
-                    "_device_mode": True
-                })
-
-        conn.disconnect()
+        bounds = checkin_time_bounds()
+        transactions = attendance_to_transactions(records, bounds)
+        del records
 
         # Apply sequence adjustment to ensure proper IN/OUT alternation
         frappe.logger().info(f"Device mode: Got {len(transactions)} transactions, applying sequence adjustment")
-        transactions = adjust_checkin_sequence(transactions)
+        transactions = adjust_checkin_sequence(dedupe_transactions(transactions))
+        device_id = f"{ip}:{port}"
+        existing_set = prefetch_checkins_for_transactions(transactions)
 
         # Create checkins with adjusted log types
         created = 0
-        for transaction in transactions:
-            if create_checkin_from_attendance_v2(transaction, f"{ip}:{port}"):
+        for i, transaction in enumerate(transactions, 1):
+            if create_checkin_from_attendance_v2(transaction, device_id, existing_set, bounds):
                 created += 1
+            if i % BATCH_COMMIT_SIZE == 0:
+                frappe.db.commit()
 
-        frappe.db.set_single_value("ZKTeco Config", "last_sync", now_datetime())
-        total_synced = frappe.db.get_single_value("ZKTeco Config", "total_synced_records") or 0
-        frappe.db.set_single_value("ZKTeco Config", "total_synced_records", total_synced + created)
+        record_sync_totals(now_datetime(), created)
         frappe.db.commit()
+        frappe.clear_document_cache("ZKTeco Config", "ZKTeco Config")
 
         frappe.logger().info(f"Device mode sync completed: {created} records created")
         return {"success": True, "created": created}
     except Exception as e:
+        frappe.db.rollback()
         frappe.log_error(f"Device mode sync failed: {str(e)}", "ZKTeco Device Sync Error")
         return {"success": False, "message": str(e)}
     finally:
@@ -1274,7 +1847,8 @@ def device_mode_sync():
         frappe.cache().delete_value(lock_key)
 
 
-def create_checkin_from_attendance(att, device_id):
+def create_checkin_from_attendance(att, device_id, bounds=None):
+    _, earliest, latest = bounds or checkin_time_bounds()
     try:
         emp_code = str(getattr(att, "user_id", "") or "").strip()
         if not emp_code:
@@ -1287,15 +1861,8 @@ def create_checkin_from_attendance(att, device_id):
             return False
 
         # Validate timestamp is reasonable
-        current_time = now_datetime()
-        max_past_days = 90
-
-        # Check if timestamp is in the future
-        if punch_datetime > current_time + timedelta(minutes=5):
-            return False
-
-        # Check if timestamp is too old
-        if punch_datetime < current_time - timedelta(days=max_past_days):
+        punch_epoch = epoch_seconds(punch_datetime)
+        if punch_epoch > latest or punch_epoch < earliest:
             return False
 
         log_type = "IN"
@@ -1304,34 +1871,40 @@ def create_checkin_from_attendance(att, device_id):
             log_type = "OUT" if punch_val == 1 else "IN"
         except Exception:
             log_type = "IN"
-        # Fixed: Include log_type in duplicate check to allow both IN and OUT
+        # Fixed: Include log_type in duplicate check to allow both IN and OUT.
+        # Same key as prefetch_existing_checkins, an idx_zkt_checkin_dedup seek
         existing = frappe.db.exists("Employee Checkin", {
             "employee": employee,
             "time": punch_datetime,
-            "device_id": device_id,
             "log_type": log_type
         })
         if existing:
             return True
-        checkin = frappe.get_doc({
+        insert_checkin({
             "doctype": "Employee Checkin",
             "employee": employee,
             "time": punch_datetime,
             "log_type": log_type,
             "device_id": device_id,
-            "skip_auto_attendance": 0
+            "skip_auto_attendance": 0,
+            "source": CHECKIN_SOURCE
         })
-        checkin.insert(ignore_permissions=True)
-        frappe.db.commit()
         return True
     except Exception:
         return False
 
 
-def create_checkin_from_attendance_v2(transaction, device_id):
+def create_checkin_from_attendance_v2(transaction, device_id, existing_set=None, bounds=None):
     """
     Create checkin from transaction dict (used after sequence adjustment)
+
+    Args:
+        transaction: Transaction dict built from device attendance
+        device_id: Device identifier stored on the checkin
+        existing_set: Optional set from prefetch_existing_checkins, checked instead of querying for duplicates
+        bounds: Optional checkin_time_bounds() shared by the whole batch
     """
+    _, earliest, latest = bounds or checkin_time_bounds()
     try:
         emp_code = transaction.get("emp_code")
         if not emp_code:
@@ -1342,58 +1915,67 @@ def create_checkin_from_attendance_v2(transaction, device_id):
             frappe.logger().debug(f"Employee not found for code: {emp_code}")
             return False
 
-        punch_datetime = transaction.get("punch_time") or transaction.get("timestamp")
+        # API mode punch times arrive as strings; parsed the same way as the
+        # prefetch window so the prefetch key matches
+        punch_datetime, _field = get_transaction_punch_time(transaction)
         if not punch_datetime:
             return False
 
         # Validate timestamp is reasonable
-        current_time = now_datetime()
-        max_past_days = 90
-
-        # Check if timestamp is in the future
-        if punch_datetime > current_time + timedelta(minutes=5):
-            return False
-
-        # Check if timestamp is too old
-        if punch_datetime < current_time - timedelta(days=max_past_days):
+        punch_epoch = epoch_seconds(punch_datetime)
+        if punch_epoch > latest or punch_epoch < earliest:
             return False
 
         # Use log_type from adjusted sequence (this is the key fix!)
         log_type = transaction.get("log_type", "IN")
 
         # Log the action for debugging
-        frappe.logger().debug(f"Creating {log_type} checkin for {employee} at {punch_datetime}")
+        log = frappe.logger()
+        is_debug = log.isEnabledFor(logging.DEBUG)
+        if is_debug:
+            log.debug("Creating %s checkin for %s at %s", log_type, employee, punch_datetime)
 
         # Check for existing record with same time and log_type
-        existing = frappe.db.exists("Employee Checkin", {
-            "employee": employee,
-            "time": punch_datetime,
-            "device_id": device_id,
-            "log_type": log_type
-        })
+        key = (employee, punch_epoch, log_type)
+        if existing_set is not None:
+            existing = key in existing_set
+        else:
+            existing = frappe.db.exists("Employee Checkin", {
+                "employee": employee,
+                "time": punch_datetime,
+                "log_type": log_type
+            })
 
         if existing:
-            frappe.logger().debug(f"Duplicate found, skipping: {employee} at {punch_datetime} ({log_type})")
+            if is_debug:
+                log.debug("Duplicate found, skipping: %s at %s (%s)", employee, punch_datetime, log_type)
             return True
 
         # Create the checkin
-        checkin = frappe.get_doc({
+        insert_checkin({
             "doctype": "Employee Checkin",
             "employee": employee,
             "time": punch_datetime,
             "log_type": log_type,
             "device_id": device_id,
-            "skip_auto_attendance": 0
+            "skip_auto_attendance": 0,
+            "source": CHECKIN_SOURCE
         })
-        checkin.insert(ignore_permissions=True)
-        frappe.db.commit()
+        if existing_set is not None:
+            existing_set.add(key)
 
-        frappe.logger().info(f"✅ Created {log_type} checkin for {employee} at {punch_datetime}")
+        # Per-row detail only; callers log the created count once per device
+        if is_debug:
+            log.debug("✅ Created %s checkin for %s at %s", log_type, employee, punch_datetime)
         return True
 
+    except frappe.DuplicateEntryError as e:
+        # Safety net only: known duplicates are skipped above without an INSERT, and
+        # insert_checkin already rolled back to its savepoint
+        frappe.logger().debug(f"Duplicate checkin detected and skipped: {str(e)}")
+        return True
     except Exception as e:
         frappe.logger().error(f"Error creating checkin: {str(e)}")
-        frappe.db.rollback()
         return False
 
 
@@ -1403,51 +1985,29 @@ def fix_existing_checkins():
     One-click fix for existing checkin records with wrong IN/OUT log types
     """
     try:
-        from collections import defaultdict
-
-        # Get all ZKTeco checkin records
-        checkins = frappe.get_all("Employee Checkin",
-            filters={"device_id": ["like", "%:4370%"]},
-            fields=["name", "employee", "employee_name", "time", "log_type"],
-            order_by="employee asc, time asc"
-        )
+        # Classify every device mode checkin in SQL: per employee and date, odd punches
+        # are IN and even ones OUT, except the last of several which is always OUT.
+        # Only rows whose log type has to change come back
+        updates = frappe.db.sql(FIX_LOG_TYPE_QUERY, {"device_id": "%:4370%"})
 
-        if not checkins:
+        if not updates and not frappe.db.exists("Employee Checkin", {"device_id": ["like", "%:4370%"]}):
             return {"success": True, "message": "No records found to fix"}
 
-        # Group by employee and date
-        grouped = defaultdict(list)
-        for checkin in checkins:
-            emp = checkin.employee
-            dt = get_datetime(checkin.time)
-            date_key = dt.strftime("%Y-%m-%d")
-            grouped[(emp, date_key)].append({
-                "name": checkin.name,
-                "time": dt,
-                "current_log_type": checkin.log_type
-            })
-
-        updates = []
-        for (emp, date), daily_checkins in grouped.items():
-            daily_checkins.sort(key=lambda x: x["time"])
-
-            for idx, checkin in enumerate(daily_checkins):
-                if idx == 0:
-                    correct = "IN"
-                elif idx == len(daily_checkins) - 1:
-                    correct = "OUT"
-                else:
-                    prev = daily_checkins[idx - 1].get("correct_log_type", daily_checkins[idx - 1]["current_log_type"])
-                    correct = "OUT" if prev == "IN" else "IN"
-
-                checkin["correct_log_type"] = correct
-
-                if checkin["current_log_type"] != correct:
-                    updates.append((checkin["name"], correct))
+        # Apply updates as one UPDATE per target log type per chunk
+        user = frappe.session.user or "Administrator"
+        for start in range(0, len(updates), UPDATE_CHUNK_SIZE):
+            chunk = updates[start:start + UPDATE_CHUNK_SIZE]
+            for log_type in ("IN", "OUT"):
+                names = tuple(name for name, correct in chunk if correct == log_type)
+                if not names:
+                    continue
 
-        # Apply updates
-        for name, log_type in updates:
-            frappe.db.set_value("Employee Checkin", name, "log_type", log_type, update_modified=True)
+                frappe.db.sql(
+                    """UPDATE `tabEmployee Checkin`
+                        SET log_type = %(log_type)s, modified = NOW(), modified_by = %(user)s
+                        WHERE name IN %(names)s""",
+                    {"log_type": log_type, "user": user, "names": names}
+                )
 
         frappe.db.commit()
 
@@ -1468,26 +2028,28 @@ def remove_duplicate_checkins():
     Remove duplicate Employee Checkin records (same employee + time + log_type)
     """
     try:
-        checkins = frappe.get_all("Employee Checkin",
-            filters={"device_id": ["like", "%:4370%"]},
-            fields=["name", "employee", "time", "log_type", "creation"],
-            order_by="employee asc, time asc, creation asc"
-        )
-
-        seen = {}
-        to_delete = []
-
-        for checkin in checkins:
-            key = (checkin.employee, str(checkin.time), checkin.log_type)
-
-            if key in seen:
-                to_delete.append(checkin.name)
-            else:
-                seen[key] = checkin.name
-
-        # Delete duplicates
-        for name in to_delete:
-            frappe.delete_doc("Employee Checkin", name, ignore_permissions=True, force=True)
+        # Duplicates are found in SQL; only the names to delete come back
+        to_delete = frappe.db.sql_list(DUPLICATE_CHECKINS_QUERY, {"device_id": "%:4370%"})
+
+        # Delete duplicates with plain DELETEs instead of delete_doc. Unlike
+        # delete_doc (force only skipped its link checks), this runs no
+        # on_trash/after_delete hooks and keeps no Deleted Document backups;
+        # acceptable for exact duplicates of a checkin that stays. The Comment
+        # and Version rows delete_doc would have cleaned up are removed with
+        # each chunk so none are left pointing at a deleted checkin.
+        # Employee Checkin has no child tables
+        for start in range(0, len(to_delete), DELETE_CHUNK_SIZE):
+            names = {"names": tuple(to_delete[start:start + DELETE_CHUNK_SIZE])}
+            frappe.db.sql("DELETE FROM `tabEmployee Checkin` WHERE name IN %(names)s", names)
+            frappe.db.sql(
+                """DELETE FROM `tabComment`
+                    WHERE reference_doctype = 'Employee Checkin' AND reference_name IN %(names)s""",
+                names
+            )
+            frappe.db.sql(
+                "DELETE FROM `tabVersion` WHERE ref_doctype = 'Employee Checkin' AND docname IN %(names)s",
+                names
+            )
 
         frappe.db.commit()
 
@@ -1514,50 +2076,82 @@ def sync_multiple_devices(cfg):
         total_created = 0
         total_devices = 0
         failed_devices = []
+        synced_counts = {}
+        # ETag and Last-Modified of API responses that were fully processed
+        synced_validators = {}
+        # Per-device counts, logged once as a summary instead of inside the sync
+        device_stats = []
 
+        devices = []
         for device in cfg.devices:
             if not device.enabled:
                 frappe.logger().info(f"Skipping disabled device: {device.device_name}")
                 continue
+            devices.append(device)
 
+        # Reading a device is pure network wait, so every device is fetched in a
+        # worker thread while the main thread, which owns the database
+        # connection, writes checkins for devices as their data arrives
+        executor = ThreadPoolExecutor(max_workers=max(1, min(MAX_DEVICE_WORKERS, len(devices))))
+        futures = [executor.submit(fetch_device_data, device) for device in devices]
+
+        for device, future in zip(devices, futures):
             try:
                 frappe.logger().info(f"Syncing device: {device.device_name} ({device.server_ip}:{device.server_port})")
 
-                # Check if device mode (port 4370) or API mode
-                port = str(device.server_port).strip()
-                if port == "4370":
-                    result = sync_single_device_mode(device)
-                else:
-                    result = sync_single_api_mode(device)
+                data, validators, result = future.result()
+                if result is None:
+                    # Check if device mode (port 4370) or API mode
+                    if is_device_mode(device):
+                        result = sync_single_device_mode(device, data)
+                    else:
+                        result = sync_single_api_mode(device, data)
 
                 if result.get("success"):
+                    # Each device's checkins are committed as soon as it is
+                    # done, so a later device failing can't take them with it
+                    frappe.db.commit()
+                    if validators and any(validators):
+                        synced_validators[device.name] = validators
                     total_created += result.get("created", 0)
                     total_devices += 1
-
-                    # Update device sync stats
-                    frappe.db.set_value("ZKTeco Device", device.name, {
-                        "last_sync": now_datetime(),
-                        "total_synced": (device.total_synced or 0) + result.get("created", 0)
+                    synced_counts[device.name] = result.get("created", 0)
+                    device_stats.append({
+                        "device": device.device_name,
+                        "fetched": result.get("fetched", 0),
+                        "created": result.get("created", 0)
                     })
                 else:
+                    # Discard the failed device's uncommitted checkins only
+                    frappe.db.rollback()
                     failed_devices.append(f"{device.device_name}: {result.get('message', 'Unknown error')}")
 
             except Exception as e:
+                frappe.db.rollback()
                 error_msg = f"Device {device.device_name} sync failed: {str(e)}"
                 frappe.logger().error(error_msg)
                 failed_devices.append(f"{device.device_name}: {str(e)}")
 
+        executor.shutdown()
+
+        now = now_datetime()
+        update_device_sync_stats(synced_counts, now, synced_validators)
+
         # Update global sync stats
-        frappe.db.set_single_value("ZKTeco Config", "last_sync", now_datetime())
-        current_total = frappe.db.get_single_value("ZKTeco Config", "total_synced_records") or 0
-        frappe.db.set_single_value("ZKTeco Config", "total_synced_records", current_total + total_created)
+        record_sync_totals(now, total_created)
         frappe.db.commit()
+        # Device rows were updated behind the cached config's back; reload it on next use
+        frappe.clear_document_cache("ZKTeco Config", "ZKTeco Config")
 
         summary = f"Synced {total_devices} device(s), created {total_created} records"
         if failed_devices:
             summary += f"\n\nFailed devices:\n" + "\n".join(failed_devices)
 
-        frappe.logger().info(summary)
+        log = frappe.logger()
+        if log.isEnabledFor(logging.INFO):
+            log.info(summary)
+            if device_stats:
+                log.info("ZKTeco device sync stats: %s", dump_json(device_stats))
         return {"success": True, "message": summary, "created": total_created}
 
     except Exception as e:
@@ -1565,94 +2159,187 @@ def sync_multiple_devices(cfg):
         return {"success": False, "message": str(e)}
 
 
-def sync_single_device_mode(device):
+def update_device_sync_stats(synced_counts, now, synced_validators=None):
+    """
+    Set last_sync and add each device's created count to total_synced, for
+    every synced device in one UPDATE; the caller commits. API devices whose
+    response was fully processed also get its ETag and Last-Modified stored,
+    sent back by fetch_api_device_transactions on the next sync
+
+    Args:
+        synced_counts: dict of ZKTeco Device name -> checkins created
+        now: Sync time stored as last_sync
+        synced_validators: dict of ZKTeco Device name -> (etag, last_modified)
+    """
+    if not synced_counts:
+        return
+
+    cases = " ".join(["WHEN %s THEN %s"] * len(synced_counts))
+    values = [value for item in synced_counts.items() for value in item]
+    validator_sets = ""
+    if synced_validators:
+        validator_cases = " ".join(["WHEN %s THEN %s"] * len(synced_validators))
+        validator_sets = f""",
+                last_api_fetch_etag = CASE name {validator_cases} ELSE last_api_fetch_etag END,
+                last_api_fetch_modified = CASE name {validator_cases} ELSE last_api_fetch_modified END"""
+        for position in range(2):
+            values.extend(
+                value for name, validators in synced_validators.items() for value in (name, validators[position])
+            )
+    frappe.db.sql(
+        f"""UPDATE `tabZKTeco Device`
+            SET last_sync = %s, total_synced = COALESCE(total_synced, 0) + CASE name {cases} ELSE 0 END{validator_sets}
+            WHERE name IN %s""",
+        (now, *values, tuple(synced_counts))
+    )
+
+
+def is_device_mode(device):
+    """
+    Whether a device is read over the ZK protocol (port 4370) rather than the API
+    """
+    return str(device.server_port).strip() == "4370"
+
+
+def fetch_device_data(device):
+    """
+    The network part of a device sync, run in a worker thread by
+    sync_multiple_devices, so it must not touch the database
+
+    Returns:
+        tuple: (attendance records or API transactions, API response validators or None, None),
+            or (None, None, failed result dict)
+    """
+    if is_device_mode(device):
+        if not get_zk():
+            return None, None, {"success": False, "message": "Device library not available"}
+        return read_device_attendance(device.server_ip, int(device.server_port)), None, None
+    return fetch_api_device_transactions(device)
+
+
+def sync_single_device_mode(device, records=None):
     """
     Sync single device in Device Mode (Port 4370)
+
+    Args:
+        device: ZKTeco Device row
+        records: Attendance records already read by fetch_device_data, read here if None
     """
     try:
-        if not ZK:
-            return {"success": False, "message": "Device library not available"}
-
         ip = device.server_ip
         port = int(device.server_port)
 
-        zk = ZK(ip, port=port, timeout=10, ommit_ping=True)
-        conn = zk.connect()
-        records = conn.get_attendance()
+        if records is None:
+            if not get_zk():
+                return {"success": False, "message": "Device library not available"}
+            records = read_device_attendance(ip, port)
 
         # Convert attendance records to transaction format
-        transactions = []
-        for att in records or []:
-            emp_code = str(getattr(att, "user_id", "") or "").strip()
-            punch_datetime = getattr(att, "timestamp", None)
-            punch_val = int(getattr(att, "punch", 0))
-
-            if emp_code and punch_datetime:
-                transactions.append({
-                    "emp_code": emp_code,
-                    "punch_time": punch_datetime,
-                    "punch": punch_val,
-                    "timestamp": punch_datetime,
-                    "_device_mode": True
-                })
-
-        conn.disconnect()
+        bounds = checkin_time_bounds()
+        transactions = attendance_to_transactions(records, bounds)
+        del records
 
         # Apply sequence adjustment
-        frappe.logger().info(f"Device {device.device_name}: Got {len(transactions)} transactions")
         transactions = adjust_checkin_sequence(transactions)
 
-        # Create checkins
+        # Create checkins, checking duplicates against one prefetch for the batch
         created = 0
         device_id = f"{ip}:{port}"
-        for transaction in transactions:
-            if create_checkin_from_attendance_v2(transaction, device_id):
+        existing_set = prefetch_checkins_for_transactions(transactions)
+        for i, transaction in enumerate(transactions, 1):
+            if create_checkin_from_attendance_v2(transaction, device_id, existing_set, bounds):
                 created += 1
+            if i % BATCH_COMMIT_SIZE == 0:
+                frappe.db.commit()
 
-        frappe.logger().info(f"Device {device.device_name}: Created {created} records")
-        return {"success": True, "created": created}
+        return {"success": True, "fetched": len(transactions), "created": created}
 
     except Exception as e:
         return {"success": False, "message": str(e)}
 
 
-def sync_single_api_mode(device):
+def fetch_api_device_transactions(device):
+    """
+    Fetch a device's transactions from its API. Network only, no database access.
+    The validators stored on the device by the last fully processed sync are
+    sent back, so an unchanged collection costs a 304. The response's own are
+    returned, not stored: sync_multiple_devices saves them once the
+    transactions are committed
+
+    Returns:
+        tuple: (transactions, (etag, last_modified), None), or (None, None, failed result dict)
+    """
+    token = device.token
+
+    if not token:
+        return None, None, {"success": False, "message": "API token not configured"}
+
+    # Fetch transactions using the API
+    url = api_transactions_url(device)
+    headers = {"Authorization": f"Bearer {token}"}
+    etag = device.get("last_api_fetch_etag")
+    last_modified = device.get("last_api_fetch_modified")
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    # Get transactions (simplified - you may need to adjust based on your API)
+    response = _SESSION.get(url, headers=headers, timeout=30)
+
+    # Nothing changed since the last synced response, whose validators stay stored
+    if response.status_code == 304:
+        return [], None, None
+
+    if response.status_code != 200:
+        return None, None, {"success": False, "message": f"API error: {response.status_code}"}
+
+    validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return _json_loads(response.content), validators, None
+
+
+def api_transactions_url(device):
+    """
+    Transactions endpoint of an API mode device
+    """
+    return f"http://{device.server_ip}:{device.server_port}/iclock/api/transactions/"
+
+
+def sync_single_api_mode(device, transactions=None):
     """
     Sync single device in API Mode (Port 80/443)
+
+    Args:
+        device: ZKTeco Device row
+        transactions: Transactions already fetched by fetch_device_data, fetched here if None
     """
     try:
         ip = device.server_ip
         port = device.server_port
-        token = device.token
-
-        if not token:
-            return {"success": False, "message": "API token not configured"}
 
-        # Fetch transactions using the API
-        base_url = f"http://{ip}:{port}"
-        headers = {"Authorization": f"Bearer {token}"}
+        if transactions is None:
+            transactions, _validators, error = fetch_api_device_transactions(device)
+            if error:
+                return error
 
-        # Get transactions (simplified - you may need to adjust based on your API)
-        response = requests.get(f"{base_url}/iclock/api/transactions/", headers=headers, timeout=30)
-
-        if response.status_code != 200:
-            return {"success": False, "message": f"API error: {response.status_code}"}
-
-        transactions = response.json()
         if not transactions:
             return {"success": True, "created": 0}
 
         # Apply sequence adjustment
         transactions = adjust_checkin_sequence(transactions)
 
-        # Create checkins
+        # Create checkins, checking duplicates against one prefetch for the batch
         created = 0
         device_id = f"{ip}:{port}"
-        for transaction in transactions:
-            if create_checkin_from_attendance_v2(transaction, device_id):
+        existing_set = prefetch_checkins_for_transactions(transactions)
+        bounds = checkin_time_bounds()
+        for i, transaction in enumerate(transactions, 1):
+            if create_checkin_from_attendance_v2(transaction, device_id, existing_set, bounds):
                 created += 1
+            if i % BATCH_COMMIT_SIZE == 0:
+                frappe.db.commit()
 
-        return {"success": True, "created": created}
+        return {"success": True, "fetched": len(transactions), "created": created}
 
     except Exception as e:
         return {"success": False, "message": str(e)}